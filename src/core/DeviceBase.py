@@ -6,6 +6,8 @@ from common import printValue
 from core import Functions, Flags
 from core.ApplianceBase import ApplianceBase
 from core.util.BasicUtil import log, is_number, convert_number, is_bool, NoneValueClass
+from core.util.KNXDCache import KNXGroupCache
+from core.util.KNXDQueue import KNXWriteQueue
 from core.util.KNXDUtil import DPTXlatorFactoryFacade
 from pknyx.core.dptXlator.dptXlatorBase import DPTXlatorValueError
 
@@ -61,11 +63,16 @@ class KNXDDevice:
         :returns    KNX raw value from bus
         """
 
+        # shadow cache is fed by the bus monitor and our own writes
+        raw = KNXGroupCache().get(knxSrc)
+        if raw is not None:
+            return raw
+
         # EIBCache gets stuck in the processing when explicitly calling readKNXAttribute +
         # EIBCache throws errors for existing exceptions for addresses not within the major address space
         # e.g. Client source address "1/1/1", works for "1/1/2" or "1/2/1" but not for "24/1/1"
         #
-        # retrieve values via cmd tool as alternative
+        # retrieve values via cmd tool as fallback for addresses not seen so far
         #try:
         #    raw = EIBClientFactory().getClient().GroupCache_Read(knxSrc)
         #except ValueError:
@@ -76,6 +83,10 @@ class KNXDDevice:
         rf = re.findall(regex, raw)
         if len(rf) > 0:
             raw = rf[0].strip()
+            KNXGroupCache().update(knxSrc, raw)
+
+        # keep track of further changes via bus monitor
+        KNXGroupCache().watch(knxSrc)
 
         return raw
 
@@ -116,7 +127,7 @@ class KNXDDevice:
                           knxDest:str, knxFormat:str,
                           val, function=None, flags=None) -> bool:
         """
-        writes values via the KNXD command line tool
+        writes values via the central write queue and the shared knxd connection
         :returns true if successful
         """
         dpt = None
@@ -130,7 +141,7 @@ class KNXDDevice:
         # perform transformations if defined before sending to bus
         if function:
             val = self.performFunction(dc.dpt, function, val,
-                                       attrName, knxDest, knxFormat)
+                                       attrName, knxDest, knxFormat, flags)
 
         # check value, some functions like an exclusive equal comparison may return None
         # for valid reason with no further write action to be performed
@@ -159,10 +170,11 @@ class KNXDDevice:
         # do not load the bus with unnecessary request, check against cached value
         if (flags and Flags.FLAGS_FORCE in flags) or \
                 not self.isCurrentKNXAttribute(knxDest, knxFormat, dpt):
-            # send value to the knx bus
-            os.popen('knxtool groupwrite ip:{0} {1} {2}'.format(KNXGateway().hostIP,
-                                                                knxDest,
-                                                                dpt))
+            # send value to the knx bus via the central write queue
+            if not KNXWriteQueue().enqueue(knxDest, dpt):
+                log('error',
+                    f'Value could not be sent to KNX bus "{attrName}"[{knxDest}] value={val}[DPT:{dpt}]')
+                return False
 
             # log success
             if flags and Flags.FLAGS_FORCE in flags:
@@ -179,10 +191,10 @@ class KNXDDevice:
         return True
 
     def performFunction(self, dpt, function, val,
-                        attrName, knxDest, knxFormat):
+                        attrName, knxDest, knxFormat, flags=None):
         """ calls Functions library, overwrite in case of client specific behavior required """
         return Functions.executeFunction(self, dpt, function, val,
-                                         attrName, knxDest, knxFormat)
+                                         attrName, knxDest, knxFormat, flags)
 
     @staticmethod
     def isCurrentKNXAttribute(knxDest, knxFormat, newVal) -> bool:
@@ -3,6 +3,7 @@ from datetime import datetime
 
 from EIBClient import EIBClientFactory, EIBClientListener
 from common import printGroup, printValue
+from core import Functions
 from core.DeviceBase import KNXDDevice
 from core.util.BasicUtil import log, NoneValueClass
 from core.util.KNXDUtil import DPTXlatorFactoryFacade
@@ -113,7 +114,8 @@ class KNX2KNXClientListener(EIBClientListener):
         self.attrName = attrName
         self.knxFormat = knxFormat
         self.knxDest = knxDest
-        self.function = function
+        # parsed once, executed for every value change
+        self.function = Functions.compileFunction(function) if function else None
         self.flags = flags
         # self.knxAggr = knxAggr
         # self.zigTrans = zigTrans
@@ -1,17 +1,41 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
 import paho.mqtt.client as mqtt
 
 from core.ApplianceBase import ApplianceBase
+from core import Functions
 from core.DeviceBase import KNXDDevice
+from core.Scheduler import UpdateScheduler
 from core.util.BasicUtil import log
+from core.util.MQTTUtil import MQTTTopicTrie, mqtt_utils
 
+# reconnect backoff boundaries in seconds
+MQTT_RECONNECT_MIN = 1
+MQTT_RECONNECT_MAX = 60
+# default number of distinct topics buffered while the broker is not reachable
+MQTT_DEFAULT_BUFFER = 500
+MQTT_DEFAULT_PORT = 1883
 
 class MQTTAppliance(ApplianceBase):
     def __init__(self, host,
-                 port=None, user=None, passwd=None):
+                 port=None, user=None, passwd=None,
+                 qos=None, retain=None, bufferSize=None):
         self.host = host
         self.port = port
         self.user = user
         self.pwd = passwd
+        # publishing settings for *2mqtt requests
+        self.qos = int(qos) if qos else 0
+        self.retain = bool(retain)
+        self.bufferSize = int(bufferSize) if bufferSize else MQTT_DEFAULT_BUFFER
+        # long-lived publisher, connected on first request
+        self.__publisher = None
+        # one subscription connection dispatching to all mqtt2knx attributes of the broker
+        self.__subscriber = None
+        self.__lock = threading.Lock()
 
     def getName(self) -> str:
         return "MQTT Appliance"
@@ -21,91 +45,339 @@ class MQTTAppliance(ApplianceBase):
         custom implementation to suit *2mqtt requests
         will update the define attribute on the MQTT broker
         """
-        # setup temporary client for one-time request
-        client = _MQTTBaseClient(self.host, self.port, self.user, self.pwd, attr)
-        client.setAttribute(attr, val, function)
-        client.closeConnection()
+        with self.__lock:
+            if self.__publisher is None:
+                self.__publisher = _MQTTPublisher(self.host, self.port, self.user, self.pwd,
+                                                  self.qos, self.retain, self.bufferSize)
+        return self.__publisher.publish(attr, val)
 
-    def setupClient(self, name, topic, knxAddr, knxFormat, mqttFormat=None, function=None, flags=None):
-        client = _MQTT2KNXClient(self.host, self.port, self.user, self.pwd,
-                                 name, topic, mqttFormat,
-                                 knxAddr, knxFormat, function, flags)
-        client.start()
+    def getStatistics(self) -> dict:
+        """ returns publishing statistics - published, buffered, dropped, failed, latency (last/avg in sec) """
+        if self.__publisher is None:
+            return {}
+        return self.__publisher.getStatistics()
 
+    def close(self):
+        """ disconnects publisher and subscriber from broker """
+        with self.__lock:
+            if self.__publisher is not None:
+                self.__publisher.close()
+                self.__publisher = None
+            if self.__subscriber is not None:
+                self.__subscriber.close()
+                self.__subscriber = None
 
-class _MQTTBaseClient(KNXDDevice):
-    def __init__(self, host, port, user, passwd, name):
-        super(_MQTTBaseClient, self).__init__()
+    def setupClient(self, name, topic, knxAddr, knxFormat, mqttFormat=None, function=None, flags=None,
+                    minInterval=None, debounce=None, deadband=None, deadbandRel=None, path=None):
+        """
+        registers mqtt2knx attribute for topic (wildcards '+' and '#' supported) on the shared subscriber
+        :param path:        value location within JSON payload for format 'json', e.g. '$.ENERGY.Power'
+        :param minInterval: min number of seconds between two KNX updates, latest value is sent when it elapsed
+        :param debounce:    number of seconds without new message before the latest value is sent
+        :param deadband:    min absolute change of a numeric value compared to the last value sent
+        :param deadbandRel: min change of a numeric value relative to the last value sent (e.g. 0.05 for 5%)
+        :raises ValueError in case of an invalid JSON path
+        """
+        # compile before connecting, configuration errors are reported at startup
+        handler = _MQTT2KNXClient(name, mqttFormat,
+                                  knxAddr, knxFormat, function, flags,
+                                  minInterval, debounce, deadband, deadbandRel, path)
+        with self.__lock:
+            if self.__subscriber is None:
+                self.__subscriber = _MQTTSubscriber(self.host, self.port, self.user, self.pwd, self.qos)
+        self.__subscriber.addHandler(topic, handler)
 
-        # set up MQTT client connection to broker
-        self.client = mqtt.Client("KNXBridgeDaemon-" + name)
 
-        # authenticate
-        if user and passwd:
-            self.client.username_pw_set(username=user,
-                                        password=passwd)
-        elif user:
-            self.client.username_pw_set(username=user)
+def _createClient(clientID, user, passwd) -> mqtt.Client:
+    """ paho client with authentication and reconnect backoff """
+    client = mqtt.Client(clientID)
+    if user and passwd:
+        client.username_pw_set(username=user,
+                               password=passwd)
+    elif user:
+        client.username_pw_set(username=user)
+    client.reconnect_delay_set(MQTT_RECONNECT_MIN, MQTT_RECONNECT_MAX)
+    return client
 
-        try:
-            # establish connection
-            if host and port:
-                self.client.connect(host=host, port=port)
+
+class _MQTTPublisher:
+    """
+    persistent, auto-reconnecting connection publishing all *2mqtt values of one broker
+    values are buffered while the broker is not reachable (latest value per topic wins)
+    """
+
+    def __init__(self, host, port, user, passwd, qos, retain, bufferSize):
+        self.host = host
+        self.port = int(port) if port else MQTT_DEFAULT_PORT
+        self.qos = qos
+        self.retain = retain
+        self.bufferSize = bufferSize
+
+        self.__lock = threading.Lock()
+        self.__connected = False
+        self.__buffer = OrderedDict()
+        # publish start time per message id, ids acknowledged before being registered
+        self.__inflight = {}
+        self.__acked = set()
+        self.__stats = {'published': 0, 'buffered': 0, 'dropped': 0, 'failed': 0,
+                        'latency': 0.0, 'latencyAvg': 0.0}
+
+        self.client = _createClient("KNXBridgeDaemon-publisher-{0}".format(id(self)), user, passwd)
+        self.client.on_connect = self.__onConnect
+        self.client.on_disconnect = self.__onDisconnect
+        self.client.on_publish = self.__onPublish
+
+        # network loop keeps reconnecting in the background
+        self.client.connect_async(host=self.host, port=self.port)
+        self.client.loop_start()
+
+    def publish(self, topic, val) -> bool:
+        """ publishes value or buffers it while disconnected, returns false if value was dropped """
+        with self.__lock:
+            if not self.__connected:
+                return self.__bufferValue(topic, val)
+
+        return self.__publish(topic, val)
+
+    def getStatistics(self) -> dict:
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats['buffer'] = len(self.__buffer)
+        return stats
+
+    def close(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def __bufferValue(self, topic, val) -> bool:
+        # lock held by caller
+        if topic not in self.__buffer and len(self.__buffer) >= self.bufferSize:
+            self.__stats['dropped'] += 1
+            log('warning',
+                'MQTT buffer for {0} full ({1}), dropped value for topic {2}'.format(self.host,
+                                                                                   self.bufferSize,
+                                                                                   topic))
+            return False
+        self.__buffer[topic] = val
+        self.__buffer.move_to_end(topic)
+        self.__stats['buffered'] += 1
+        return True
+
+    def __publish(self, topic, val) -> bool:
+        begin = time.monotonic()
+        info = self.client.publish(topic, val, qos=self.qos, retain=self.retain)
+
+        with self.__lock:
+            if info.rc == mqtt.MQTT_ERR_NO_CONN:
+                # connection dropped in between, keep value for reconnect
+                return self.__bufferValue(topic, val)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self.__stats['failed'] += 1
+                log('error',
+                    'Could not publish to MQTT server {0} topic {1} [{2}]'.format(self.host,
+                                                                                  topic,
+                                                                                  mqtt.error_string(info.rc)))
+                return False
+
+            if info.mid in self.__acked:
+                self.__acked.discard(info.mid)
+                self.__recordLatency(begin)
             else:
-                self.client.connect(host=host)
-        except ConnectionRefusedError as ex:
+                self.__inflight[info.mid] = begin
+        return True
+
+    def __recordLatency(self, begin):
+        # lock held by caller
+        latency = time.monotonic() - begin
+        self.__stats['published'] += 1
+        self.__stats['latency'] = latency
+        self.__stats['latencyAvg'] += (latency - self.__stats['latencyAvg']) / self.__stats['published']
+
+    def __onConnect(self, client, userdata, flags, rc):
+        if rc != 0:
             log('error',
-                'Could not connect to MQTT server {0} port {1} [{2}]'.format(host,
-                                                                             port,
-                                                                             ex))
+                'Could not connect to MQTT server {0} port {1} [{2}]'.format(self.host,
+                                                                             self.port,
+                                                                             mqtt.connack_string(rc)))
+            return
 
-        def setAttribute(self, attr, val, function):
-            raise NotImplementedError
+        with self.__lock:
+            self.__connected = True
+            pending = list(self.__buffer.items())
+            self.__buffer.clear()
+        for topic, val in pending:
+            self.__publish(topic, val)
 
-    def setAttribute(self, attr, val, function):
-        """
-        updates value on broker
-        """
-        self.client.publish(attr, val)
+    def __onDisconnect(self, client, userdata, rc):
+        with self.__lock:
+            self.__connected = False
+        if rc != 0:
+            log('warning',
+                'Connection to MQTT server {0} lost, reconnecting [{1}]'.format(self.host,
+                                                                               mqtt.error_string(rc)))
+
+    def __onPublish(self, client, userdata, mid):
+        with self.__lock:
+            begin = self.__inflight.pop(mid, None)
+            if begin is None:
+                # acknowledged before publish() returned
+                self.__acked.add(mid)
+            else:
+                self.__recordLatency(begin)
+
+
+class _MQTTSubscriber:
+    """
+    persistent, auto-reconnecting connection subscribing to the topics of all mqtt2knx attributes of one broker
+    messages are dispatched to the attribute handlers via a topic trie
+    """
+
+    def __init__(self, host, port, user, passwd, qos):
+        self.host = host
+        self.port = int(port) if port else MQTT_DEFAULT_PORT
+        self.qos = qos
 
-    def closeConnection(self):
+        self.__lock = threading.Lock()
+        self.__connected = False
+        self.__topics = MQTTTopicTrie()
+
+        self.client = _createClient("KNXBridgeDaemon-subscriber-{0}".format(id(self)), user, passwd)
+        self.client.on_connect = self.__onConnect
+        self.client.on_disconnect = self.__onDisconnect
+        self.client.on_message = self.__onMessage
+
+        # network loop keeps reconnecting in the background
+        self.client.connect_async(host=self.host, port=self.port)
+        self.client.loop_start()
+
+    def addHandler(self, topic, handler):
+        """ registers handler providing updateReceived(client, userdata, message, doc) for topic filter """
+        with self.__lock:
+            isNew = self.__topics.add(topic, handler)
+            subscribe = isNew and self.__connected
+
+        if subscribe:
+            self.__subscribe([topic])
+
+    def close(self):
         self.client.disconnect()
+        self.client.loop_stop()
+
+    def __subscribe(self, topics):
+        try:
+            rc, mid = self.client.subscribe([(topic, self.qos) for topic in topics])
+            if rc != mqtt.MQTT_ERR_SUCCESS:
+                log('error',
+                    'Could not subscribe to MQTT server {0} topics {1} [{2}]'.format(self.host,
+                                                                                   topics,
+                                                                                   mqtt.error_string(rc)))
+        except ValueError as ex:
+            log('error',
+                'Could not subscribe to MQTT server {0} topics {1} [{2}]'.format(self.host,
+                                                                               topics,
+                                                                               ex))
+
+    def __onConnect(self, client, userdata, flags, rc):
+        if rc != 0:
+            log('error',
+                'Could not connect to MQTT server {0} port {1} [{2}]'.format(self.host,
+                                                                             self.port,
+                                                                             mqtt.connack_string(rc)))
+            return
+
+        # subscriptions are renewed on every (re)connect
+        with self.__lock:
+            self.__connected = True
+            topics = sorted(self.__topics.filters)
+        if topics:
+            self.__subscribe(topics)
+
+    def __onDisconnect(self, client, userdata, rc):
+        with self.__lock:
+            self.__connected = False
+        if rc != 0:
+            log('warning',
+                'Connection to MQTT server {0} lost, reconnecting [{1}]'.format(self.host,
+                                                                               mqtt.error_string(rc)))
+
+    def __onMessage(self, client, userdata, message):
+        with self.__lock:
+            handlers = self.__topics.match(message.topic)
+
+        # JSON payload is decoded once for all attributes of the topic
+        doc = None
+        if any(handler.mqttFormat == mqtt_utils.MQTTFORMAT_JSON for handler in handlers):
+            try:
+                doc = json.loads(message.payload)
+            except ValueError as ex:
+                log('warning',
+                    'Could not interpret JSON payload of MQTT topic {0} [{1}]'.format(message.topic,
+                                                                                     ex))
+                handlers = [handler for handler in handlers if handler.mqttFormat != mqtt_utils.MQTTFORMAT_JSON]
+
+        for handler in handlers:
+            # one failing attribute must not stop dispatching to the others
+            try:
+                handler.updateReceived(client, userdata, message, doc)
+            except Exception as ex:
+                log('error',
+                    'Could not process MQTT message for {0} topic {1} [{2}]'.format(handler.attrName,
+                                                                                    message.topic,
+                                                                                    ex))
 
 
-class _MQTT2KNXClient(_MQTTBaseClient):
+class _MQTT2KNXClient(KNXDDevice):
     """
-    client class which initiates a listener threads which reports any chage from the broker
-    via the callback function
+    mqtt2knx attribute handler, receives messages of its topic from the shared subscriber and writes them to KNX
+    high frequency topics are reduced by min interval, debounce and deadband before touching the KNX bus
     """
 
-    def __init__(self, host, port, user, passwd,
-                 name, topic, mqttFormat,
-                 knxDest, knxFormat, function, flags):
-        super(_MQTT2KNXClient, self).__init__(host, port, user, passwd, name)
+    def __init__(self, name, mqttFormat,
+                 knxDest, knxFormat, function, flags,
+                 minInterval=None, debounce=None, deadband=None, deadbandRel=None, path=None):
+        super(_MQTT2KNXClient, self).__init__()
 
         self.attrName = name
         self.mqttFormat= mqttFormat
         self.knxDest = knxDest
         self.knxFormat = knxFormat
-        self.function = function
+        # parsed once, executed for every message
+        self.function = Functions.compileFunction(function) if function else None
         self.flags = flags
+        # raises ValueError for invalid path expressions
+        if mqttFormat == mqtt_utils.MQTTFORMAT_JSON and not path:
+            raise ValueError('mqttPath required for mqttFormat "{0}"'.format(mqttFormat))
+        self.path = mqtt_utils.compileJSONPath(path)
 
-        try:
-            # listener target/endpoint
-            self.client.on_message = self.updateReceived
+        self.minInterval = float(minInterval) if minInterval else 0
+        self.debounce = float(debounce) if debounce else 0
+        self.deadband = float(deadband) if deadband else 0
+        self.deadbandRel = float(deadbandRel) if deadbandRel else 0
+        self.__filtered = self.minInterval > 0 or self.debounce > 0 or self.deadband > 0 or self.deadbandRel > 0
 
-            self.client.subscribe(topic)
-        except ValueError as ex:
-            log('error',
-                'Could not connect to MQTT server {0} for endpoint {1} [{2}]'.format(host,
-                                                                                     topic,
-                                                                                     ex))
+        # latest received value not yet sent, handed over from the network thread to the scheduler loop
+        self.__lock = threading.Lock()
+        self.__pending = None
+        self.__hasPending = False
+        # owned by the scheduler loop
+        self.__timer = None
+        self.__lastVal = None
+        self.__lastSent = None
 
-    def start(self):
-        self.client.loop_start()
-
-    def updateReceived(self, client, userdata, message):
-        val = message.payload.decode("utf-8")
+    def updateReceived(self, client, userdata, message, doc=None):
+        """ :param doc: JSON payload already decoded by the subscriber for format 'json' """
+        if self.mqttFormat == mqtt_utils.MQTTFORMAT_JSON:
+            if doc is None:
+                doc = json.loads(message.payload)
+            try:
+                val = mqtt_utils.extractJSONPath(doc, self.path)
+            except LookupError:
+                # payload without this value, e.g. different message types on the same topic
+                return
+            if val is None or isinstance(val, (dict, list)):
+                return
+        else:
+            val = message.payload.decode("utf-8")
 
         if self.mqttFormat == 'int':
             val = int(val)
@@ -119,5 +391,79 @@ class _MQTT2KNXClient(_MQTTBaseClient):
         elif self.mqttFormat == 'str':
             val = str(val)
 
+        if not self.__filtered:
+            self.__forward(val)
+            return
+
+        with self.__lock:
+            self.__pending = val
+            self.__hasPending = True
+
+        loop = UpdateScheduler().loop
+        if loop is None:
+            # no timers without scheduler, apply deadband only
+            self.__flush(False)
+        else:
+            loop.call_soon_threadsafe(self.__schedule)
+
+    def __schedule(self):
+        """ runs within the scheduler loop, (re)arms the timer sending the pending value """
+        loop = UpdateScheduler().loop
+        if self.debounce > 0:
+            # trailing edge - every message restarts the quiet period
+            if self.__timer is not None:
+                self.__timer.cancel()
+            delay = self.debounce
+        elif self.__timer is not None:
+            # pending value was replaced, timer already armed
+            return
+        else:
+            delay = 0
+
+        if self.minInterval > 0 and self.__lastSent is not None:
+            delay = max(delay, self.__lastSent + self.minInterval - time.monotonic())
+
+        if delay > 0:
+            self.__timer = loop.call_later(delay, self.__flush)
+        else:
+            self.__timer = None
+            self.__flush()
+
+    def __flush(self, executor=True):
+        """ sends the pending value unless it is within the deadband of the last value sent """
+        self.__timer = None
+        with self.__lock:
+            if not self.__hasPending:
+                return
+            val = self.__pending
+            self.__pending = None
+            self.__hasPending = False
+
+        if self.__withinDeadband(val):
+            return
+        self.__lastVal = val
+        self.__lastSent = time.monotonic()
+
+        if executor:
+            # bus access must not block the scheduler loop
+            UpdateScheduler().loop.run_in_executor(None, self.__forward, val)
+        else:
+            self.__forward(val)
+
+    def __withinDeadband(self, val) -> bool:
+        """ true if numeric value did not move by more than every configured deadband """
+        last = self.__lastVal
+        if last is None or isinstance(val, bool) or not isinstance(val, (int, float)) or \
+                isinstance(last, bool) or not isinstance(last, (int, float)):
+            return False
+
+        delta = abs(val - last)
+        if self.deadband > 0 and delta <= self.deadband:
+            return True
+        if self.deadbandRel > 0 and delta <= self.deadbandRel * abs(last):
+            return True
+        return False
+
+    def __forward(self, val):
         super().writeKNXAttribute(self.attrName, self.knxDest, self.knxFormat,
                                   val, function=self.function, flags=self.flags)
@@ -1,22 +1,53 @@
-from datetime import datetime
+import threading
+import time
 
 from pymodbus.client.sync import ModbusTcpClient
 
 from core.ApplianceBase import ApplianceBase
 from core.DeviceBase import KNXDDevice
 from core.util.BasicUtil import log
-from core.util.ModBusUtil import modbus_utils
+from core.util.ModBusUtil import modbus_utils, ModBusField, ModBusRegisterDecoder, MODBUS_DEFAULT_UNIT
+
+# reconnect backoff boundaries in seconds
+MODBUS_RECONNECT_MIN = 1
+MODBUS_RECONNECT_MAX = 60
+# default socket timeout in seconds for connect and each request
+MODBUS_DEFAULT_TIMEOUT = 3
 
 
 class ModBusClient(KNXDDevice, ApplianceBase):
-    def __init__(self, host, port):
+    def __init__(self, host, port, maxGap=None,
+                 unit=None, byteorder=None, wordorder=None, timeout=None):
         super(ModBusClient, self).__init__()
 
-        self.__mbcImpl = ModbusTcpClient(host, port)
+        # an offline appliance blocks its own update for at most the timeout per request
+        self.timeout = float(timeout) if timeout else MODBUS_DEFAULT_TIMEOUT
+        self.__mbcImpl = ModbusTcpClient(host, port, timeout=self.timeout)
+        # max number of unused registers between attributes still read in one request
+        self.maxGap = int(maxGap) if maxGap else 0
+        # register map definition of the appliance
+        self.unit = int(unit) if unit is not None else MODBUS_DEFAULT_UNIT
+        self.decoder = ModBusRegisterDecoder(byteorder, wordorder)
+
+        # connection is kept open across update cycles, shared by all frequency classes
+        self.__lock = threading.RLock()
+        self.__retryDelay = MODBUS_RECONNECT_MIN
+        self.__nextRetry = 0
+        self.__stats = {'connects': 0, 'reconnects': 0, 'errors': 0, 'requests': 0,
+                        'latency': 0.0, 'latencyAvg': 0.0}
 
     def getName(self) -> str:
         return "ModBus Appliance"
 
+    def getStatistics(self) -> dict:
+        """ returns connection statistics - connects, reconnects, errors, requests, latency (last/avg in sec) """
+        with self.__lock:
+            return dict(self.__stats)
+
+    def close(self):
+        with self.__lock:
+            self.__mbcImpl.close()
+
     # segregator for KNX-independent messaging to MQTT
     def writeAttribute(self, type: str, attrName: str,
                        dest: str, format: str,
@@ -31,40 +62,132 @@ class ModBusClient(KNXDDevice, ApplianceBase):
                                                            val, function, flags)
         return ret
 
-    # specific attribute requests based on configuration
-    def getAttribute(self, attrName, mbFormat, mbAddr):
-        val = None
+    #########################################
+    #   connection handling                 #
+    #########################################
+    def __connect(self) -> bool:
+        """ lock held by caller, reuses open connection or reconnects respecting the backoff """
+        if self.__mbcImpl.is_socket_open():
+            return True
+
+        if time.monotonic() < self.__nextRetry:
+            return False
 
         if self.__mbcImpl.connect():
-            try:
-                # check modbus data type
-                # TODO implement more ModBus datatypes
-                if mbFormat == 'float':
-                    # configuration supports summing up multiple values automatically
-                    # single value from corresponding modbus client
-                    if isinstance(mbAddr, int):
-                        val = modbus_utils.ReadFloat(self.__mbcImpl,
-                                                     mbAddr)
-                    # sum of multiple values from corresponding modbus client
-                    elif isinstance(mbAddr, list):
-                        val = 0
-                        # TODO implement functions
-                        for ids in mbAddr:
-                            val = val + modbus_utils.ReadFloat(self.__mbcImpl,
-                                                               ids)
-            except Exception as ex:
-                log('warning',
-                    'Error reading ModBus value - {0}: {1}'.format(attrName,
-                                                                   ex))
+            if self.__stats['connects'] > 0:
+                self.__stats['reconnects'] += 1
+            self.__stats['connects'] += 1
+            self.__retryDelay = MODBUS_RECONNECT_MIN
+            return True
+
+        # log connection error
+        log('error',
+            'Could not connect to ModBus server {0}:{1}, retry in {2}s'.format(self.__mbcImpl.host,
+                                                                              self.__mbcImpl.port,
+                                                                              self.__retryDelay))
+        self.__stats['errors'] += 1
+        self.__nextRetry = time.monotonic() + self.__retryDelay
+        self.__retryDelay = min(self.__retryDelay * 2, MODBUS_RECONNECT_MAX)
+        return False
 
+    def __readRegisters(self, start, count) -> list:
+        """
+        lock held by caller, reads holding registers on the persistent connection
+        :raises IOError in case of a failed request, connection is reset for the next request
+        """
+        begin = time.monotonic()
+        try:
+            rr = self.__mbcImpl.read_holding_registers(start, count, unit=self.unit)
+        except Exception:
+            self.__stats['errors'] += 1
+            # drop connection, it might be stale - next request reconnects
             self.__mbcImpl.close()
-        else:
-            # log connection error
+            raise
+
+        if rr.isError():
+            self.__stats['errors'] += 1
+            raise IOError(str(rr))
+
+        latency = time.monotonic() - begin
+        self.__stats['requests'] += 1
+        self.__stats['latency'] = latency
+        self.__stats['latencyAvg'] += (latency - self.__stats['latencyAvg']) / self.__stats['requests']
+        return rr.registers
+
+    #########################################
+    #   attribute requests                  #
+    #########################################
+    def readRegisterBlocks(self, spans) -> list:
+        """
+        reads all register spans merged into as few read requests as possible
+        :param spans:   list of tuples (start address, number of registers)
+        :returns list of tuples (start address, list of registers), failed requests are omitted
+        """
+        blocks = []
+
+        with self.__lock:
+            for start, count in modbus_utils.planBlocks(spans, self.maxGap):
+                if not self.__connect():
+                    break
+                try:
+                    blocks.append((start, self.__readRegisters(start, count)))
+                except Exception as ex:
+                    # attributes of this block fall back to single reads
+                    log('warning',
+                        'Error reading ModBus register block {0}-{1}: {2}'.format(start,
+                                                                                  start + count - 1,
+                                                                                  ex))
+
+        return blocks
+
+    def compileFields(self, mbFormat, mbAddr, scale=None, length=None) -> list:
+        """
+        compiles register map definition of an attribute
+        :raises ValueError in case of an unsupported format definition
+        """
+        addrs = mbAddr if isinstance(mbAddr, list) else [mbAddr]
+        return [ModBusField(addr, mbFormat, scale, length) for addr in addrs]
+
+    def getFieldValue(self, attrName, fields, aggregate=False, values=None):
+        """
+        returns value of compiled fields, decoded from previously read register blocks if available
+        :param aggregate:   sum up values of all fields
+        :param values:      optional dictionary of field and value as returned by decoder for the current cycle
+        """
+        vals = []
+
+        try:
+            for field in fields:
+                if values is not None and field in values:
+                    vals.append(values[field])
+                    continue
+
+                # field not part of a successful block read
+                with self.__lock:
+                    if not self.__connect():
+                        return None
+                    vals.append(self.decoder.decodeRegisters(field, self.__readRegisters(field.addr, field.count)))
+        except Exception as ex:
+            log('warning',
+                'Error reading ModBus value - {0}: {1}'.format(attrName,
+                                                               ex))
+            return None
+
+        if not vals:
+            return None
+        # configuration supports summing up multiple values automatically
+        return sum(vals) if aggregate else vals[0]
+
+    # specific attribute requests based on configuration
+    def getAttribute(self, attrName, mbFormat, mbAddr, scale=None, length=None):
+        try:
+            fields = self.compileFields(mbFormat, mbAddr, scale, length)
+        except ValueError as ex:
             log('error',
-                'Could not connect to ModBus server {0}:{1}'.format(self.__mbcImpl.host,
-                                                                    self.__mbcImpl.port))
+                'Configuration error - {0}: {1}'.format(attrName, ex))
+            return None
 
-        return val
+        return self.getFieldValue(attrName, fields, isinstance(mbAddr, list))
 
     def setAttribute(self, attr, val):
         """
@@ -1,9 +1,18 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
 from typing import Dict
 
-import requests
-import yaml
+import httpx
 import json
 
+try:
+    # optional - required for push mode only
+    import websockets
+except ImportError:
+    websockets = None
+
 ### ZigBee constants
 # ZigBee client type
 from EIBClient import EIBClientListener, EIBClientFactory
@@ -11,6 +20,7 @@ from common import printGroup, printValue
 from core import Functions
 from core.ApplianceBase import ApplianceBase
 from core.DeviceBase import KNXDDevice
+from core.Scheduler import UpdateScheduler
 from core.util.BasicUtil import log
 from core.util.ZigBeeUtil import zigbee_utils
 from json.decoder import JSONDecodeError
@@ -22,6 +32,23 @@ ZIGBEETYPEDEF: Dict[int, str] = {
     3: "groups"
 }
 
+# client sections updated by websocket change events
+ZIGBEEEVENTSECTIONS = ("state", "config")
+
+# default interval in seconds for a full state resync in push mode
+ZIGBEE_DEFAULT_RESYNC = 600
+# websocket reconnect backoff boundaries in seconds
+ZIGBEE_RECONNECT_MIN = 1
+ZIGBEE_RECONNECT_MAX = 60
+# default timeout in seconds for gateway requests
+ZIGBEE_DEFAULT_TIMEOUT = 5
+# max number of pooled keep-alive connections to the gateway
+ZIGBEE_MAX_CONNECTIONS = 4
+# default time in seconds a loaded state is considered fresh, coinciding update cycles share one request
+ZIGBEE_DEFAULT_STATE_TTL = 1
+# default window in seconds merging attribute updates for the same client into one request
+ZIGBEE_DEFAULT_COALESCE = 0.05
+
 class ZigBeeGateway(ApplianceBase):
     """ central singleton gateway handling all ZigBee client requests (r/w) """
     __instance = None
@@ -29,6 +56,29 @@ class ZigBeeGateway(ApplianceBase):
     __deconzPort = 0
     __deconzToken = None
     __state = None
+    # push mode via websocket event stream
+    __push = False
+    __pushActive = False
+    __wsPort = None
+    __resync = ZIGBEE_DEFAULT_RESYNC
+    # pooled http clients, the async client is bound to the scheduler loop
+    __client = None
+    __asyncClient = None
+    __timeout = ZIGBEE_DEFAULT_TIMEOUT
+    __stats = {'requests': 0, 'errors': 0, 'latency': 0.0, 'latencyAvg': 0.0}
+    # change detection - state revision and revision of last change per (type, id, section, attr)
+    __revision = 0
+    __revisions = {}
+    # single flight state requests - resource types to load, time of last load and request in flight
+    __types = set()
+    __stateTTL = ZIGBEE_DEFAULT_STATE_TTL
+    __stateTime = 0
+    __stateCond = threading.Condition()
+    __fetching = False
+    __lastChanges = set()
+    # pending state updates per request path merged within the coalescing window, owned by the scheduler loop
+    __coalesce = ZIGBEE_DEFAULT_COALESCE
+    __pending = {}
 
     def __new__(cls, *args, **kwargs):
         if ZigBeeGateway.__instance is None:
@@ -39,11 +89,61 @@ class ZigBeeGateway(ApplianceBase):
         return "ZigBee Appliance"
 
     @staticmethod
-    def initialize(deconzIP, deconzPort, deconzToken):
+    def initialize(deconzIP, deconzPort, deconzToken,
+                   push=False, wsPort=None, resync=None, timeout=None, stateTTL=None, coalesce=None):
         ZigBeeGateway.__deconzIP = deconzIP
         ZigBeeGateway.__deconzPort = deconzPort
         ZigBeeGateway.__deconzToken = deconzToken
         ZigBeeGateway.__state = None
+        ZigBeeGateway.__push = bool(push)
+        ZigBeeGateway.__wsPort = wsPort
+        if resync:
+            ZigBeeGateway.__resync = float(resync)
+        if timeout:
+            ZigBeeGateway.__timeout = float(timeout)
+        if stateTTL is not None:
+            ZigBeeGateway.__stateTTL = float(stateTTL)
+        ZigBeeGateway.__stateTime = 0
+        if coalesce is not None:
+            ZigBeeGateway.__coalesce = float(coalesce)
+
+        # keep-alive connection pool for all gateway requests
+        ZigBeeGateway.__client = httpx.Client(base_url=ZigBeeGateway.__getBaseUrl(),
+                                              timeout=ZigBeeGateway.__timeout,
+                                              limits=httpx.Limits(max_connections=ZIGBEE_MAX_CONNECTIONS,
+                                                                  max_keepalive_connections=ZIGBEE_MAX_CONNECTIONS))
+        ZigBeeGateway.__asyncClient = None
+
+    @staticmethod
+    def __getBaseUrl() -> str:
+        return "http://{0}:{1}/api/{2}/".format(ZigBeeGateway.__deconzIP,
+                                               ZigBeeGateway.__deconzPort,
+                                               ZigBeeGateway.__deconzToken)
+
+    @staticmethod
+    def __recordLatency(begin, success=True):
+        stats = ZigBeeGateway.__stats
+        if not success:
+            stats['errors'] += 1
+            return
+        latency = time.monotonic() - begin
+        stats['requests'] += 1
+        stats['latency'] = latency
+        stats['latencyAvg'] += (latency - stats['latencyAvg']) / stats['requests']
+
+    def getStatistics(self) -> dict:
+        """ returns request statistics - requests, errors, latency (last/avg in sec) """
+        return dict(ZigBeeGateway.__stats)
+
+    def close(self):
+        """ closes pooled connections to the gateway """
+        if ZigBeeGateway.__asyncClient is not None:
+            future = UpdateScheduler().runCoroutine(ZigBeeGateway.__asyncClient.aclose())
+            if future is not None:
+                future.result(ZigBeeGateway.__timeout)
+            ZigBeeGateway.__asyncClient = None
+        if ZigBeeGateway.__client is not None:
+            ZigBeeGateway.__client.close()
 
     def isActive(self):
         # check whether ZigBeeGateway is initialized
@@ -51,19 +151,298 @@ class ZigBeeGateway(ApplianceBase):
             return False
         return True
 
-    def getState(self):
-        """ performs get request to load latest status of all clients """
+    def isPushEnabled(self) -> bool:
+        """ true if push mode via websocket event stream is configured """
+        return self.isActive() and ZigBeeGateway.__push
+
+    def isPushActive(self) -> bool:
+        """ true if websocket event stream is connected and keeps the state current """
+        return ZigBeeGateway.__pushActive
+
+    def addResourceType(self, type: str):
+        """ registers resource type (lights, sensors, groups) used by a client, only these are loaded """
+        if type in ZIGBEETYPEDEF.values():
+            with ZigBeeGateway.__stateCond:
+                ZigBeeGateway.__types.add(type)
+
+    def getState(self, force=False) -> set:
+        """
+        loads latest status of all clients, concurrent callers share one request (single flight)
+        a state younger than the configured TTL is reused, while a refresh is in flight callers
+        continue with the last known (stale) state instead of waiting for a slow gateway
+        :param force:   ignore TTL, e.g. to resync after a reconnect
+        :returns set of (type, id, section, attr) tuples changed compared to the previous state
+        """
         if not(self.isActive()):
+            return set()
+
+        with ZigBeeGateway.__stateCond:
+            if ZigBeeGateway.__fetching:
+                if ZigBeeGateway.__state is not None and not force:
+                    # stale while revalidate
+                    return set()
+                while ZigBeeGateway.__fetching:
+                    ZigBeeGateway.__stateCond.wait()
+                return ZigBeeGateway.__lastChanges
+
+            if not force and ZigBeeGateway.__state is not None and \
+                    time.monotonic() - ZigBeeGateway.__stateTime < ZigBeeGateway.__stateTTL:
+                return set()
+
+            ZigBeeGateway.__fetching = True
+            types = sorted(ZigBeeGateway.__types)
+
+        changes = set()
+        try:
+            state = self.__loadState(types)
+            if state is not None:
+                changes = ZigBeeGateway.diffState(ZigBeeGateway.__state, state)
+                ZigBeeGateway.__state = state
+                ZigBeeGateway.__markChanged(changes)
+                # a failed request is retried by the next caller instead of counting as fresh state
+                ZigBeeGateway.__stateTime = time.monotonic()
+        finally:
+            with ZigBeeGateway.__stateCond:
+                ZigBeeGateway.__lastChanges = changes
+                ZigBeeGateway.__fetching = False
+                ZigBeeGateway.__stateCond.notify_all()
+        return changes
+
+    def __loadState(self, types):
+        """
+        requests resource types used by configured clients, entire gateway state if none are registered
+        :returns state document or None if no request succeeded, failed types keep their last known state
+        """
+        if not types:
+            return self.__request("")
+
+        # websocket port is announced in the config section
+        if ZigBeeGateway.__push and not ZigBeeGateway.__wsPort:
+            types = types + ['config']
+
+        state = dict(ZigBeeGateway.__state) if isinstance(ZigBeeGateway.__state, dict) else {}
+        loaded = False
+        for type in types:
+            doc = self.__request(type)
+            if doc is not None:
+                state[type] = doc
+                loaded = True
+        return state if loaded else None
+
+    def __request(self, path):
+        begin = time.monotonic()
+        try:
+            response = ZigBeeGateway.__client.get(path)
+            response.raise_for_status()
+            doc = response.json()
+            ZigBeeGateway.__recordLatency(begin)
+            return doc
+        except (httpx.HTTPError, ValueError) as e:
+            ZigBeeGateway.__recordLatency(begin, False)
+            log('info',
+                'Could not connect to ZigBee client [getState{0}]: {1}'.format(' ' + path if path else '', e))
+            return None
+
+    #########################################
+    #   change detection                    #
+    #########################################
+    @staticmethod
+    def diffState(old, new) -> set:
+        """
+        compares two gateway states client by client
+        :returns set of (type, id, section, attr) tuples that differ, section is '' for top level attributes
+        """
+        changes = set()
+        if not isinstance(new, dict):
+            return changes
+        if not isinstance(old, dict):
+            old = {}
+
+        for type in ZIGBEETYPEDEF.values():
+            newClients = new.get(type)
+            if not isinstance(newClients, dict):
+                continue
+            oldClients = old.get(type) if isinstance(old.get(type), dict) else {}
+
+            for id, newClient in newClients.items():
+                oldClient = oldClients.get(id)
+                # identical client documents need no further inspection
+                if newClient == oldClient or not isinstance(newClient, dict):
+                    continue
+                if not isinstance(oldClient, dict):
+                    oldClient = {}
+
+                for key, newVal in newClient.items():
+                    oldVal = oldClient.get(key)
+                    if isinstance(newVal, dict):
+                        if newVal != oldVal:
+                            oldSection = oldVal if isinstance(oldVal, dict) else {}
+                            changes.update((type, id, key, attr) for attr, val in newVal.items()
+                                           if attr not in oldSection or oldSection[attr] != val)
+                    elif key not in oldClient or newVal != oldVal:
+                        changes.add((type, id, '', key))
+
+        return changes
+
+    @staticmethod
+    def __markChanged(changes):
+        if not changes:
             return
+        ZigBeeGateway.__revision += 1
+        for change in changes:
+            ZigBeeGateway.__revisions[change] = ZigBeeGateway.__revision
+
+    def getChangeRevision(self, id, type, attr, section=None) -> int:
+        """ returns state revision in which the attribute changed last, 0 if never seen """
+        if section is None:
+            section = 'state'
+        return ZigBeeGateway.__revisions.get((type, str(id), section, attr), 0)
+
+    #########################################
+    #   push mode - websocket event stream  #
+    #########################################
+    def applyEvent(self, message):
+        """
+        applies a websocket change event to the in-memory state
+        :param message: event in JSON representation, e.g. {"t":"event","e":"changed","r":"sensors","id":"2","state":{..}}
+        :returns tuple (type, id) of the changed client or None if event did not change the state
+        """
+        try:
+            event = json.loads(message)
+        except (JSONDecodeError, TypeError) as ex:
+            log('warning',
+                'Could not interpret ZigBee event: {0}'.format(ex))
+            return None
+
+        if not isinstance(event, dict) or event.get('t') != 'event' or event.get('e') != 'changed':
+            return None
 
         try:
-            response = requests.get("http://{0}:{1}/api/{2}/".format(ZigBeeGateway.__deconzIP,
-                                                                     ZigBeeGateway.__deconzPort,
-                                                                     ZigBeeGateway.__deconzToken))
-            ZigBeeGateway.__state = yaml.safe_load(response.text)
-        except requests.exceptions.RequestException as e:
+            client = ZigBeeGateway.__state[event['r']][str(event['id'])]
+        except (KeyError, TypeError):
+            # client unknown so far, will be picked up by next resync
+            return None
+
+        type = event['r']
+        id = str(event['id'])
+        changes = set()
+        for section in ZIGBEEEVENTSECTIONS:
+            if isinstance(event.get(section), dict):
+                current = client.setdefault(section, {})
+                changes.update((type, id, section, attr) for attr, val in event[section].items()
+                               if attr not in current or current[attr] != val)
+                current.update(event[section])
+        # attribute events update top level attributes like name or lastseen
+        if isinstance(event.get('attr'), dict):
+            changes.update((type, id, '', attr) for attr, val in event['attr'].items()
+                           if attr not in client or client[attr] != val)
+            client.update(event['attr'])
+
+        ZigBeeGateway.__markChanged(changes)
+        return (type, id) if changes else None
+
+    async def listen(self, onChange, url=None):
+        """
+        subscribes to the deCONZ websocket event stream and applies incremental updates to the state
+        full state is reloaded after each (re)connect and periodically as safety net
+        :param onChange:    callback(type, id) for each changed client, called within the event loop
+        :param url:         websocket url, defaults to the websocket port announced by the gateway
+        """
+        if websockets is None:
+            log('error',
+                'ZigBee push mode requires the websockets package - falling back to polling')
+            return
+
+        loop = asyncio.get_running_loop()
+        resync = asyncio.ensure_future(self.__resyncPeriodically())
+        delay = ZIGBEE_RECONNECT_MIN
+        try:
+            while True:
+                try:
+                    # catch up with changes missed while disconnected
+                    changes = await loop.run_in_executor(None, self.getState, True)
+                    for change in {change[:2] for change in changes}:
+                        onChange(*change)
+                    wsUrl = url if url else self.__getWebSocketUrl()
+
+                    async with websockets.connect(wsUrl) as ws:
+                        log('info', 'Connected to ZigBee event stream {0}'.format(wsUrl))
+                        ZigBeeGateway.__pushActive = True
+                        delay = ZIGBEE_RECONNECT_MIN
+
+                        async for message in ws:
+                            change = self.applyEvent(message)
+                            if change:
+                                onChange(*change)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as ex:
+                    log('warning',
+                        'ZigBee event stream disconnected, reconnect in {0}s: {1}'.format(delay, ex))
+
+                ZigBeeGateway.__pushActive = False
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, ZIGBEE_RECONNECT_MAX)
+        finally:
+            ZigBeeGateway.__pushActive = False
+            resync.cancel()
+
+    async def __resyncPeriodically(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(ZigBeeGateway.__resync)
+            if ZigBeeGateway.__pushActive:
+                await loop.run_in_executor(None, self.getState, True)
+
+    def __getWebSocketUrl(self) -> str:
+        port = ZigBeeGateway.__wsPort
+        if not port:
+            try:
+                port = ZigBeeGateway.__state['config']['websocketport']
+            except (KeyError, TypeError):
+                raise ConnectionError('websocket port not announced by gateway, define deConzWSPort')
+        return "ws://{0}:{1}".format(ZigBeeGateway.__deconzIP, port)
+
+    @staticmethod
+    def __getStatePath(id, type) -> str:
+        # groups are switched via their action resource
+        if type == ZIGBEETYPEDEF[3]:
+            return "{0}/{1}/action".format(type, id)
+        return "{0}/{1}/state".format(type, id)
+
+    def findGroup(self, lightIDs, name=None, create=False):
+        """
+        returns id of the deCONZ group consisting of exactly the given lights
+        :param name:    name of the group to be created if no matching group exists
+        :param create:  creates missing group, otherwise None is returned
+        """
+        if not(self.isActive()):
+            return None
+
+        members = {str(id) for id in lightIDs}
+        try:
+            response = ZigBeeGateway.__client.get(ZIGBEETYPEDEF[3])
+            response.raise_for_status()
+            for id, group in response.json().items():
+                if isinstance(group, dict) and set(group.get('lights', [])) == members:
+                    return id
+
+            if not create:
+                return None
+
+            response = ZigBeeGateway.__client.post(ZIGBEETYPEDEF[3], json={'name': name})
+            response.raise_for_status()
+            id = response.json()[0]['success']['id']
+            response = ZigBeeGateway.__client.put("{0}/{1}".format(ZIGBEETYPEDEF[3], id),
+                                                  json={'lights': sorted(members)})
+            response.raise_for_status()
             log('info',
-                'Could not connect to ZigBee client [getState]: {0}'.format(e))
+                'Created ZigBee group {0}({1}) for lights {2}'.format(name, id, sorted(members)))
+            return id
+        except (httpx.HTTPError, ValueError, KeyError, IndexError, TypeError) as e:
+            log('warning',
+                'Could not resolve ZigBee group for lights {0}: {1}'.format(sorted(members), e))
+            return None
 
     def getClientState(self, id, type, attr, section=None):
         """ get attribute for a defined client """
@@ -106,20 +485,88 @@ class ZigBeeGateway(ApplianceBase):
         if function:
             val = Functions.executeFunction(None, None, function, val,
                                             attr, None, None)
+
+        begin = time.monotonic()
         try:
-            response = requests.put("http://{0}:{1}/api/{2}/{3}/{4}/{5}".format(ZigBeeGateway.__deconzIP,
-                                                                                ZigBeeGateway.__deconzPort,
-                                                                                ZigBeeGateway.__deconzToken,
-                                                                                type,
-                                                                                id,
-                                                                                'state'),
-                                    json={attr: val})
-        except requests.exceptions.ConnectionError as e:
+            response = ZigBeeGateway.__client.put(ZigBeeGateway.__getStatePath(id, type),
+                                                  json={attr: val})
+        except httpx.HTTPError as e:
+            ZigBeeGateway.__recordLatency(begin, False)
             return False
 
-        if response.status_code != 200:
+        ZigBeeGateway.__recordLatency(begin, response.status_code == 200)
+        return response.status_code == 200
+
+    def putClientStateAsync(self, id, type, attr, val, function):
+        """
+        sends attribute update via the scheduler loop without blocking the caller
+        updates for the same client within the coalescing window are merged into one request
+        :returns concurrent.futures.Future resolving to true if successful
+        """
+        # perform transformations if defined before sending
+        if function:
+            val = Functions.executeFunction(None, None, function, val,
+                                            attr, None, None)
+
+        future = UpdateScheduler().runCoroutine(self.__putCoalesced(ZigBeeGateway.__getStatePath(id, type), attr, val))
+        if future is None:
+            # scheduler not running, send synchronously
+            future = Future()
+            future.set_result(self.putClientState(id, type, attr, val, None))
+        return future
+
+    async def __putCoalesced(self, path, attr, val) -> bool:
+        """ runs within the scheduler loop, the first update of a window sends the merged body for all """
+        if ZigBeeGateway.__coalesce <= 0:
+            return await self.__put(path, {attr: val})
+
+        pending = ZigBeeGateway.__pending.get(path)
+        if pending is not None:
+            # latest value per attribute wins
+            pending[0][attr] = val
+            return await asyncio.shield(pending[1])
+
+        body = {attr: val}
+        result = asyncio.get_running_loop().create_future()
+        ZigBeeGateway.__pending[path] = (body, result)
+        try:
+            await asyncio.sleep(ZigBeeGateway.__coalesce)
+        except asyncio.CancelledError:
+            result.cancel()
+            raise
+        finally:
+            del ZigBeeGateway.__pending[path]
+
+        try:
+            success = await self.__put(path, body)
+        except Exception as ex:
+            # followers are usually not awaited, report failure as result
+            log('error',
+                'Could not update ZigBee client [{0}] with {1}: {2}'.format(path, body, ex))
+            success = False
+        result.set_result(success)
+        return success
+
+    async def __put(self, path, body) -> bool:
+        if not(self.isActive()):
             return False
-        return True
+
+        if ZigBeeGateway.__asyncClient is None:
+            ZigBeeGateway.__asyncClient = httpx.AsyncClient(base_url=ZigBeeGateway.__getBaseUrl(),
+                                                            timeout=ZigBeeGateway.__timeout,
+                                                            limits=httpx.Limits(max_connections=ZIGBEE_MAX_CONNECTIONS,
+                                                                                max_keepalive_connections=ZIGBEE_MAX_CONNECTIONS))
+        begin = time.monotonic()
+        try:
+            response = await ZigBeeGateway.__asyncClient.put(path, json=body)
+        except httpx.HTTPError as e:
+            ZigBeeGateway.__recordLatency(begin, False)
+            log('warning',
+                'Could not connect to ZigBee client [{0}]: {1}'.format(path, e))
+            return False
+
+        ZigBeeGateway.__recordLatency(begin, response.status_code == 200)
+        return response.status_code == 200
 
 
 class ZigBeeClient(KNXDDevice):
@@ -136,6 +583,8 @@ class ZigBeeClient(KNXDDevice):
         self.name = name
         self.deconzID = deconzID
         self.deconzType = deconzType
+        # only resource types in use are loaded from the gateway
+        ZigBeeGateway().addResourceType(deconzType)
 
     # generic attributes
     @property
@@ -180,6 +629,14 @@ class ZigBeeClient(KNXDDevice):
                                               val,
                                               function)
 
+    def setAttributeAsync(self, attr, val, function):
+        """ sends request to update client status without blocking, returns future resolving to success state """
+        return ZigBeeGateway().putClientStateAsync(self.deconzID,
+                                                   self.deconzType,
+                                                   attr,
+                                                   val,
+                                                   function)
+
     def installListener(self, attrName: str,
                         knxSrc: str, knxFormat: str,
                         zbAttr: str, zbFormat: str, zbSection: str, function: str):
@@ -235,6 +692,26 @@ class ZigBeeClient(KNXDDevice):
         return ret
 
 
+class ZigBeeGroupClient(ZigBeeClient):
+    """ deCONZ group switching several lights with one request, replaces identical commands per light """
+
+    def __init__(self, name, groupID, members):
+        # group state is not loaded from the gateway, skip resource type registration
+        KNXDDevice.__init__(self)
+        self.name = name
+        self.deconzID = groupID
+        self.deconzType = ZIGBEETYPEDEF[3]
+        self.members = members
+
+    @property
+    def reachable(self) -> bool:
+        return True
+
+    @property
+    def uniqueID(self) -> str:
+        return 'group {0}{1}'.format(self.deconzID, [client.deconzID for client in self.members])
+
+
 class ZigBeeClientListener(EIBClientListener):
     """
     will route knx event trigger received from EIB/KNX client to zigbee device
@@ -252,7 +729,8 @@ class ZigBeeClientListener(EIBClientListener):
         self.zbSection = zbSection
         self.zbAttr = zbAttr
         self.zbFormat = zbFormat
-        self.function = function
+        # parsed once, executed for every value change
+        self.function = Functions.compileFunction(function) if function else None
         # self.knxAggr = knxAggr
         # self.zigTrans = zigTrans
 
@@ -282,8 +760,12 @@ class ZigBeeClientListener(EIBClientListener):
         # transform data from python to zigbee protocol adequate form
         zbValue = zigbee_utils.getZigBeeValue(self.zbFormat, val)
 
-        # sends update to zigbee device
-        if self.zbClient.setAttribute(attr=self.zbAttr, val=zbValue, function=self.function):
+        # sends update to zigbee device, listener thread does not wait for the gateway
+        future = self.zbClient.setAttributeAsync(attr=self.zbAttr, val=zbValue, function=self.function)
+        future.add_done_callback(lambda f: self.__logUpdate(f, knxSrc, zbValue, val))
+
+    def __logUpdate(self, future, knxSrc, zbValue, val):
+        if not future.cancelled() and future.exception() is None and future.result():
             log('change',
                 'Value updated based on KNX value change {0}({1}): {2}(KNX value: {3}) for ZigBee client {4}'.format(
                     self.attrName, knxSrc,
@@ -0,0 +1,202 @@
+import re
+from typing import Dict, List
+
+from core import Functions
+from core.ApplianceBase import ApplianceBase
+from core.DeviceKNX import KNX2KNXClient
+from core.DeviceModBus import ModBusClient
+from core.DeviceZigBee import ZigBeeClient, ZigBeeGateway
+from core.util.BasicUtil import getAttrSafe, log
+from core.util.KNXDUtil import DPTXlatorFactoryFacade
+from core.util.ModBusUtil import modbus_utils
+
+# functions depending on time or on the number of evaluations
+ZIGBEE_ALWAYS_EXECUTE = r"(timedelta|timechg|av|asynch)\w*\("
+
+
+class AttributeTask:
+    """
+    pre-resolved update task for one polled attribute, compiled once from its configuration
+    derived classes read the value from their source in getValue()
+    """
+
+    def __init__(self, attr, client, destAddr, destFormat, appliance: ApplianceBase = None):
+        self.name = attr['name']
+        self.type = attr['type']
+        # function chain parsed once, executed for every value
+        self.function = Functions.compileFunction(attr['function']) if getAttrSafe(attr, 'function') else None
+        self.flags = getAttrSafe(attr, 'flags')
+        self.client = client
+        self.destAddr = destAddr
+        self.destFormat = destFormat
+        self.appliance = appliance
+
+        # resolve DPT translator upfront, reports configuration errors at startup
+        self.dpt = None
+        if destFormat is not None:
+            self.dpt = DPTXlatorFactoryFacade().create(destFormat)
+            if self.dpt is None:
+                log('error',
+                    'Configuration error - "{0}": unknown DPT type "{1}", attribute is not updated'.format(self.name,
+                                                                                                         destFormat))
+
+    def getValue(self, context=None):
+        """ :param context: appliance data prepared once per tick by the ApplianceJob """
+        raise NotImplementedError
+
+    def execute(self, context=None) -> bool:
+        """
+        reads current value from source and writes it to destination
+        :returns true if the value was written
+        """
+        # value could not be converted for the KNX destination, skip reading the source
+        if self.destFormat is not None and self.dpt is None:
+            return False
+        newVal = self.getValue(context)
+
+        if newVal is None:
+            return False
+        # unchanged polled values do not restart pending asynch timers
+        with Functions.polledEvaluation():
+            return self.client.writeAttribute(self.type,
+                                              self.name,
+                                              self.destAddr,
+                                              self.destFormat,
+                                              newVal,
+                                              self.function,
+                                              self.flags,
+                                              self.appliance)
+
+
+class ModBusTask(AttributeTask):
+    """ modbus2knx and modbus2mqtt attribute """
+
+    def __init__(self, attr, client: ModBusClient, appliance: ApplianceBase = None):
+        if attr['type'] == 'modbus2mqtt':
+            # define appliance and destination for sending MQTT updates
+            super().__init__(attr, client, attr['mqttTopic'], None, appliance)
+        else:
+            super().__init__(attr, client, attr['knxAddr'], attr['knxFormat'])
+        # register map definition, raises ValueError for unsupported formats
+        self.fields = client.compileFields(attr['modbusFormat'], attr['modbusAddrDec'],
+                                           getAttrSafe(attr, 'modbusScale'), getAttrSafe(attr, 'modbusLength'))
+        self.aggregate = isinstance(attr['modbusAddrDec'], list)
+
+    def getValue(self, context=None):
+        return self.client.getFieldValue(self.name, self.fields, self.aggregate, context)
+
+
+class ZigBeeTask(AttributeTask):
+    """ zigbee2knx attribute, only processed if the attribute changed since the last execution """
+
+    def __init__(self, attr, client: ZigBeeClient):
+        super().__init__(attr, client, attr['knxAddr'], attr['knxFormat'])
+        self.zbFormat = attr['zigbeeFormat']
+        self.zbAttr = attr['zigbeeAttr']
+        self.zbSection = getAttrSafe(attr, 'zigbeeSection')
+        # state revision processed by the last execution
+        self.revision = -1
+        # time based or queueing functions need to be evaluated even if the value did not change
+        self.alwaysExecute = bool(self.function and re.search(ZIGBEE_ALWAYS_EXECUTE, self.function.function))
+
+    def execute(self, context=None):
+        revision = ZigBeeGateway().getChangeRevision(self.client.deconzID, self.client.deconzType,
+                                                     self.zbAttr, self.zbSection)
+        if revision <= self.revision and not self.alwaysExecute:
+            return False
+        # unreachable clients or failed writes are retried with the next tick
+        if not super().execute(context):
+            return False
+        self.revision = revision
+        return True
+
+    def getValue(self, context=None):
+        return self.client.getAttribute(self.name, self.zbFormat, self.zbAttr, self.zbSection)
+
+
+class KNX2KNXTask(AttributeTask):
+    """ knx2knx attribute explicitly defining an update frequency in addition to its listener """
+
+    def __init__(self, attr, client: KNX2KNXClient):
+        # knx2knx protocal foresees 'knxAddr' as the source and 'knxDest' as the destination
+        super().__init__(attr, client, attr['knxDest'], attr['knxFormat'])
+
+    def getValue(self, context=None):
+        return self.client.getSrcValue()
+
+
+class ApplianceJob:
+    """ executes all tasks of one appliance due in a tick, derive to prepare the appliance before """
+
+    def __init__(self, name: str, tasks: List[AttributeTask]):
+        self.name = name
+        self.tasks = tasks
+        # max duration in seconds the scheduler waits for the job, None for no limit
+        self.timeout = None
+
+    def prepare(self):
+        """ :returns context handed to all tasks of this tick """
+        return None
+
+    def __call__(self):
+        context = self.prepare()
+        for task in self.tasks:
+            task.execute(context)
+
+
+class ModBusJob(ApplianceJob):
+    """ reads the registers of all tasks in merged blocks and decodes all values of the tick in one pass """
+
+    def __init__(self, name: str, tasks: List[AttributeTask]):
+        super().__init__(name, tasks)
+        self.client = tasks[0].client
+        self.fields = [field for task in tasks for field in task.fields]
+        self.spans = [field.span for field in self.fields]
+        # connect plus one request per register block
+        self.timeout = self.client.timeout * (1 + len(modbus_utils.planBlocks(self.spans, self.client.maxGap)))
+
+    def prepare(self):
+        return self.client.decoder.decode(self.fields, self.client.readRegisterBlocks(self.spans))
+
+
+class ZigBeeJob(ApplianceJob):
+    """ loads latest client state from gateway once for all tasks, unless kept current by push mode """
+
+    def prepare(self):
+        if ZigBeeGateway().isActive() and not ZigBeeGateway().isPushActive():
+            ZigBeeGateway().getState()
+        return None
+
+
+class ExecutionPlan:
+    """
+    per update frequency buckets of pre-resolved tasks grouped by appliance
+    jobs are compiled once per requested frequency mask so a tick only touches attributes due
+    """
+
+    def __init__(self):
+        # update frequency mask -> appliance key -> tasks
+        self.__buckets: Dict[int, Dict[str, List[AttributeTask]]] = {}
+        self.__jobClasses: Dict[str, type] = {}
+        self.__jobs: Dict[int, Dict[str, ApplianceJob]] = {}
+
+    def add(self, freq: int, key: str, task: AttributeTask, jobClass: type = ApplianceJob):
+        """ adds task to bucket of update frequency mask and appliance key """
+        self.__buckets.setdefault(freq, {}).setdefault(key, []).append(task)
+        self.__jobClasses[key] = jobClass
+        self.__jobs.clear()
+
+    def getJobs(self, freq: int) -> Dict[str, ApplianceJob]:
+        """ returns jobs per appliance for all buckets matching the frequency mask """
+        if freq not in self.__jobs:
+            tasks = {}
+            for mask, bucket in self.__buckets.items():
+                if mask & freq > 0:
+                    for key, keyTasks in bucket.items():
+                        tasks.setdefault(key, []).extend(keyTasks)
+            self.__jobs[freq] = {key: self.__jobClasses[key](key, keyTasks)
+                                 for key, keyTasks in tasks.items()}
+        return self.__jobs[freq]
+
+    def __len__(self):
+        return sum(len(tasks) for bucket in self.__buckets.values() for tasks in bucket.values())
@@ -1,420 +1,561 @@
 import re
-from collections import deque
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 
-import dateparser as dateparser
+from core.Scheduler import DelayedActionScheduler
+from core.util.BasicUtil import log, is_number, convert_number, is_bool, convert_bool, convert_val2xy, convert_oct2int, \
+    parse_datetime, NoneValueClass
+from core.util.FunctionState import FunctionStateStore
+from core.util.KNXDDependency import KNXDependencyGraph
 
-from threading import Timer
-from core.util.BasicUtil import log, is_number, convert_number, is_bool, convert_bool, convert_val2xy, convert_oct2int, NoneValueClass
+# compiled function pipelines per function definition
+compiledList = {}
+
+# function statements of a chain, e.g. 'max(10),av(1,5),min(),hu('abc';56),oh([34/54/67]),(),async(59,val(false)),())'
+FUNCTIONSTATEMENTS = re.compile(r"([a-zA-Z0-9_-]+\(.*?\)+)[,;]?")
+
+# evaluation context per thread, distinguishes polled values from events
+_evaluation = threading.local()
+
+
+class FunctionError(Exception):
+    """ function could not be applied to the current value """
+    pass
 
-queueList = {}
 
 def executeFunction(deviceInstance, dpt, function, val,
-                    attrName, knxDest, knxFormat):
+                    attrName, knxDest, knxFormat, flags=None):
     """
     performs the selected functions val and returns the outcome. functions can be chained by givign a comma
     or semicolon separated list being processed from left to right
     :param deviceInstance:      KNXDDevice instance for knx value callbacks, type hint not specified due to import loop
     :param dpt:                 data point type of value
-    :param function:            function to be applied on value
+    :param function:            function to be applied on value, definition string or compiled FunctionPipeline
     :param val:                 val from external source
     :param attrName:            textual description of val context
     :param knxDest:             destination for value
     :param knxFormat:           string representation of target format
+    :param flags:               flags of the attribute, applied when the value is re-evaluated
     :returns val of corresponding type after function execution
     """
     if not function:
         return val
 
-    # check for appearance of a function list (function separated by comma or semicolon)
-    # sample used for evaluation 'max(10),av(1,5),min(),hu('abc';56),oh([34/54/67]),(),async(59,val(false)),())'
-    regex = r"([a-zA-Z0-9_-]+\(.*?\)+)[,;]?"
-    functionStatements = re.findall(regex, function)
-    for f in functionStatements:
-        if type(val) != NoneValueClass:
-            val = __executeFunctionImpl(deviceInstance, dpt, f, val,
-                                        attrName, knxDest, knxFormat)
+    if not isinstance(function, FunctionPipeline):
+        function = compileFunction(function)
+
+    return function.execute(deviceInstance, dpt, val,
+                            attrName, knxDest, knxFormat, flags)
+
+
+def compileFunction(function: str):
+    """
+    parses function definition once into a pipeline of operators with pre-parsed arguments
+    pipelines are shared by all attributes using the same definition
+    :returns FunctionPipeline, definition errors are listed in its errors attribute
+    """
+    global compiledList
+
+    pipeline = compiledList.get(function)
+    if pipeline is None:
+        pipeline = FunctionPipeline(function)
+        compiledList[function] = pipeline
+    return pipeline
+
 
-    return val
+@contextmanager
+def polledEvaluation():
+    """ marks function evaluations of the current thread as triggered by the update scheduler instead of an event """
+    _evaluation.polled = True
+    try:
+        yield
+    finally:
+        _evaluation.polled = False
 
 
 def _asynchWrite(deviceInstance, attrName, knxDest, knxFormat, val):
-    # called by asynchronous thread by function definition
+    # called by central timer thread for asynch function definition
     deviceInstance.writeKNXAttribute(attrName, knxDest, knxFormat, val)
 
 
-def __executeFunctionImpl(deviceInstance, dpt, function, val,
-                          attrName, knxDest, knxFormat):
-    global queueList
-    errDetail = None
+def _parseDate(val) -> datetime:
+    if isinstance(val, datetime):
+        return val
+    ret = parse_datetime(str(val))
+    if ret is None:
+        raise ValueError('unknown date format "{0}"'.format(val))
+    return ret
+
+
+def _liveValue(deviceInstance, gv, knxFormat):
+    # check for live KNX value, kept current by the dependency graph
+    if '/' in gv:
+        val = KNXDependencyGraph().getValue(gv, knxFormat)
+        if val is None and deviceInstance is not None:
+            # address not seen on the bus so far
+            val = deviceInstance.readKNXAttribute("functions live value",
+                                                  gv, knxFormat)
+        gv = val
+    return gv
+
+
+class FunctionPipeline:
+    """ compiled function chain, operators are applied from left to right """
+
+    def __init__(self, function: str):
+        self.function = function
+        self.operators = []
+        # definition errors detected while compiling, reported at startup
+        self.errors = []
+        # last input per attribute and destination, replayed when a referenced KNX address changes
+        self.__inputs = {}
+
+        for statement in FUNCTIONSTATEMENTS.findall(function):
+            try:
+                operator = _compileStatement(statement)
+                if operator is None:
+                    # unknown functions are passed without effect
+                    self.errors.append('"{0}" - unknown function'.format(statement))
+                    operator = _NoOperator(statement)
+                self.operators.append(operator)
+            except (ValueError, IndexError) as ex:
+                self.errors.append('"{0}" - wrong function definition: {1}'.format(statement, ex))
+                self.operators.append(_InvalidOperator(statement, 'wrong function definition - {0}'.format(ex)))
+
+        # KNX addresses referenced by operators, e.g. sub(1/2/3)
+        self.references = {operator.reference for operator in self.operators if operator.reference}
+        # replaying values would feed queues or restart timers a second time
+        self.reactive = len(self.references) > 0 and not any(operator.stateful for operator in self.operators)
+
+    def subscribe(self):
+        """ subscribes referenced KNX addresses, attributes are re-evaluated on changes if pipeline is reactive """
+        for knxAddr in self.references:
+            KNXDependencyGraph().subscribe(knxAddr, self if self.reactive else None)
 
-    if function[:3] == 'val':
-        # replace current value by static value
+    def referenceChanged(self, knxAddr):
+        """ called by dependency graph, re-evaluates all attributes with their last value via the central timer """
+        for (attrName, knxDest), (deviceInstance, val, knxFormat, flags) in list(self.__inputs.items()):
+            DelayedActionScheduler().schedule(('reevaluate', attrName, knxDest), 0,
+                                              lambda deviceInstance=deviceInstance, attrName=attrName,
+                                                     knxDest=knxDest, knxFormat=knxFormat, val=val, flags=flags:
+                                              deviceInstance.writeKNXAttribute(attrName, knxDest, knxFormat,
+                                                                               val, self, flags),
+                                              '{0}[{1}] {2}'.format(attrName, knxDest, self.function))
+
+    def execute(self, deviceInstance, dpt, val,
+                attrName, knxDest, knxFormat, flags=None):
+        if self.reactive and deviceInstance is not None and knxDest:
+            self.__inputs[(attrName, knxDest)] = (deviceInstance, val, knxFormat, flags)
+
+        for operator in self.operators:
+            if type(val) == NoneValueClass:
+                break
+            try:
+                val = operator.apply(deviceInstance, dpt, val,
+                                     attrName, knxDest, knxFormat)
+            except FunctionError as ex:
+                log('error',
+                    'Could not apply function "{0}" to value {1} - {2}'.format(operator.statement,
+                                                                               val,
+                                                                               ex))
+        return val
+
+
+class FunctionOperator:
+    """ one function statement of a chain, arguments are parsed once in the constructor """
+    # number of leading characters naming the function, e.g. 3 for 'max(10)'
+    nameLength = 3
+    # KNX address referenced by the argument, e.g. '1/2/3' for 'sub(1/2/3)'
+    reference = None
+    # operator keeps state across values (queues, timers)
+    stateful = False
+
+    def __init__(self, statement: str):
+        self.statement = statement
+        # raw argument string between the brackets
+        self.arg = statement[self.nameLength + 1:-1]
+
+    def apply(self, deviceInstance, dpt, val,
+              attrName, knxDest, knxFormat):
+        """
+        :returns val after function execution
+        :raises FunctionError if function cannot be applied to val
+        """
+        raise NotImplementedError
+
+
+class _InvalidOperator(FunctionOperator):
+    """ placeholder for a statement that could not be compiled, reports the error for each value """
+
+    def __init__(self, statement: str, errDetail: str):
+        super().__init__(statement)
+        self.errDetail = errDetail
+
+    def apply(self, deviceInstance, dpt, val,
+              attrName, knxDest, knxFormat):
+        raise FunctionError(self.errDetail)
+
+
+class _ValOperator(FunctionOperator):
+    """ replace current value by static value """
+
+    def __init__(self, statement: str):
+        super().__init__(statement)
+        self.val = self.arg
         try:
-            val = function[4:-1]
-            if is_number(val):
-                val = float(val)
-            elif is_bool(val):
-                val = convert_bool(val)
+            if is_number(self.val):
+                self.val = float(self.val)
+            elif is_bool(self.val):
+                self.val = convert_bool(self.val)
         except ValueError:
-            val = function[4:-1]
-    elif function[:3] == 'inv':
-        # invert current value - restricted to boolean currently
+            self.val = self.arg
+
+    def apply(self, deviceInstance, dpt, val,
+              attrName, knxDest, knxFormat):
+        return self.val
+
+
+class _InvOperator(FunctionOperator):
+    """ invert current value - restricted to boolean currently """
+
+    def apply(self, deviceInstance, dpt, val,
+              attrName, knxDest, knxFormat):
         if is_bool(val):
             # generic 0/1 representation required for dpxlator DPT conversion
-            val = not val
-        # check for legitim None value
-        elif type(val) is NoneValueClass:
-            pass # do nothing
-        else:
-            errDetail = 'wrong value type'
-    elif function[:3] == 'max':
-        # returns the greater value, useful for greater 0 assurancce
-        if is_number(val):
-            try:
-                val = convert_number(val)
-                val = max(val, float(function[4:-1]))
-            except ValueError:
-                errDetail = 'wrong function definition'
-        else:
-            errDetail = 'wrong value type'
-    elif function[:3] == 'min':
-        # returns the lower value
-        if is_number(val):
-            try:
-                val = convert_number(val)
-                val = min(val, float(function[4:-1]))
-            except ValueError:
-                errDetail = 'wrong function definition'
-        else:
-            errDetail = 'wrong value type'
-    elif function[:3] == 'rnd':
-        # rounds the current value to the given precision
-        if is_number(val):
-            try:
-                val = convert_number(val)
-                val = round(val, float(function[4:-1]))
-            except ValueError:
-                errDetail = 'wrong function definition'
-        else:
-            errDetail = 'wrong value type'
-    elif function[:3] == 'div':
-        # divide current value by given value
-        if is_number(val):
-            try:
-                val = convert_number(val)
-                div = float(function[4:-1])
-                if div is not 0:
-                    val = val / div
-                else:
-                    if float(function[4:-1]) == 0:
-                        errDetail = 'divider is zero'
-                    else:
-                        errDetail = 'wrong function definition'
-            except ValueError:
-                errDetail = 'wrong function definition'
-        else:
-            errDetail = 'wrong value type'
-    elif function[:3] == 'mul':
-        # multiply current value with given value
-        if is_number(val):
-            try:
-                val = convert_number(val)
-                div = float(function[4:-1])
-                val = val * div
-            except ValueError:
-                errDetail = 'wrong function definition'
-        else:
-            errDetail = 'wrong value type'
-    elif function[:3] == 'add':
-        # adds given value to current value
-        if is_number(val):
-            try:
-                val = convert_number(val)
-                div = float(function[4:-1])
-                val = val + div
-            except ValueError:
-                errDetail = 'wrong function definition'
-        else:
-            errDetail = 'wrong value type'
-    elif function[:3] == 'sub':
-        # substracts given value from current value
-        if is_number(val):
-            gv = function[4:-1]
-            # check for live KNX value
-            if '/' in gv:
-                gv = deviceInstance.readKNXAttribute("functions live value",
-                                                gv, knxFormat)
-            try:
-                val = convert_number(val)
-                val = val - float(gv)
-            except ValueError:
-                errDetail = 'wrong function definition'
-        else:
-            errDetail = 'wrong value type'
-    elif function[:2] == 'lt':
-        # checks if current value is less then given value
-        if is_number(val):
-            try:
-                val = float(val) < float(function[3:-1])
-            except ValueError:
-                errDetail = 'wrong function definition'
-        else:
-            errDetail = 'wrong value type'
-    elif function[:2] == 'gt':
-        # checks if current value is greater then given value
-        if is_number(val):
-            try:
-                val = float(val) > float(function[3:-1])
-            except ValueError:
-                errDetail = 'wrong function definition'
-        else:
-            errDetail = 'wrong value type'
-    elif function[:5] == 'avMax':
-        # returns the max value for a queue of values
-        # queue values are dropped sequentially when capacity is hit
-        par = re.split("[,;]", function[3:-1])
-        # split function parameter - av(<queueID>,<FIFOsize>)
-        queueID = str(par[0])
-        # check existing of queueID and save current value
-        if not queueID in queueList:
-            # optional definition of queue size, e.g. multiple references to the same queue
-            if (len(par) > 1):
-                queueSize = int(par[1])
-            else:
-                # arbitrary value
-                queueSize = 10
-            queueList[queueID] = deque(maxlen=queueSize)
-        queue = queueList[queueID]
+            return not val
+        raise FunctionError('wrong value type')
+
+
+class _ArithmeticOperator(FunctionOperator):
+    """ max, min, rnd, div, mul and add with a static numeric argument """
+
+    def __init__(self, statement: str, op):
+        super().__init__(statement)
+        self.op = op
+        # raises ValueError for non-numeric arguments
+        self.operand = float(self.arg)
+
+    def apply(self, deviceInstance, dpt, val,
+              attrName, knxDest, knxFormat):
+        if not is_number(val):
+            raise FunctionError('wrong value type')
+        return self.op(convert_number(val), self.operand)
 
-        if is_number(val):
-            queue.append(float(val))
-            # identify max value
-            for i in queue:
-                val = max(val, i)
-        elif is_bool(val):
-            queue.append(bool(val))
-            # identify false/true maximum
-            val = False
-            for i in queue:
-                if i:
-                    val = True
-                    break
-        elif type(val) == str and \
-            (val == 'Off' or val == 'On'):
-            # perform avMax execution by recursive call
-            if val == 'Off':
-                val = __executeFunctionImpl(deviceInstance, dpt, function, False,
-                                            attrName, knxDest, knxFormat)
-            else:
-                val = __executeFunctionImpl(deviceInstance, dpt, function, True,
-                                            attrName, knxDest, knxFormat)
-            # perform backward mapping to On/Off value
-            if val:
-                val = 'On'
-            else:
-                val = 'Off'
-        else:
-            errDetail = 'wrong value type'
-    elif function[:5] == 'avMin':
-        # returns the min value for a queue of values
-        # queue values are dropped sequentially when capacity is hit
-        par = re.split("[,;]", function[3:-1])
-        # split function parameter - av(<queueID>,<FIFOsize>)
-        queueID = str(par[0])
-        # check existing of queueID and save current value
-        if not queueID in queueList:
-            # optional definition of queue size, e.g. multiple references to the same queue
-            if (len(par) > 1):
-                queueSize = int(par[1])
-            else:
-                # arbitrary value
-                queueSize = 10
-            queueList[queueID] = deque(maxlen=queueSize)
-        queue = queueList[queueID]
 
+class _SubOperator(FunctionOperator):
+    """ substracts given value from current value, operand may reference a live KNX value """
+
+    def __init__(self, statement: str):
+        super().__init__(statement)
+        self.reference = self.arg.strip() if '/' in self.arg else None
+        self.operand = None if self.reference else float(self.arg)
+
+    def apply(self, deviceInstance, dpt, val,
+              attrName, knxDest, knxFormat):
+        if not is_number(val):
+            raise FunctionError('wrong value type')
+        operand = self.operand
+        try:
+            if operand is None:
+                operand = float(_liveValue(deviceInstance, self.reference, knxFormat))
+            return convert_number(val) - operand
+        except (ValueError, TypeError):
+            raise FunctionError('wrong function definition')
+
+
+class _CompareOperator(FunctionOperator):
+    """ lt and gt - checks if current value is less/greater than given value """
+    nameLength = 2
+
+    def __init__(self, statement: str, op):
+        super().__init__(statement)
+        self.op = op
+        self.operand = float(self.arg)
+
+    def apply(self, deviceInstance, dpt, val,
+              attrName, knxDest, knxFormat):
+        if not is_number(val):
+            raise FunctionError('wrong value type')
+        return self.op(float(val), self.operand)
+
+
+class _QueueOperator(FunctionOperator):
+    """
+    queueing functions av, avMax and avMin, queue values are dropped sequentially when capacity is hit
+    syntax: av(<queueID>,<size>,<duration>s), e.g. av('Power', 20) for the last 20 values, av('Power', 300s)
+    for the values of the last 5min or av('Power', 20, 300s) for both - size and duration are optional
+    for further references to the same queue
+    """
+    stateful = True
+
+    def __init__(self, statement: str, name: str):
+        self.nameLength = len(name)
+        super().__init__(statement)
+        par = [p.strip() for p in re.split("[,;]", self.arg)]
+        size = None
+        duration = None
+        for p in par[1:]:
+            if p[-1:] == 's':
+                duration = float(p[:-1])
+            elif p:
+                size = int(p)
+        # queues are separated per function type
+        self.queueID = '{0}:{1}'.format(name, par[0].strip("'\""))
+        self.size = size
+        self.duration = duration
+        FunctionStateStore().define(self.queueID, size, duration)
+
+    @property
+    def queue(self):
+        # looked up per value, the store may have evicted the window in the meantime
+        return FunctionStateStore().get(self.queueID, self.size, self.duration)
+
+
+class _AvOperator(_QueueOperator):
+    """ returns the average value for a queue of values """
+
+    def __init__(self, statement: str):
+        super().__init__(statement, 'av')
+
+    def apply(self, deviceInstance, dpt, val,
+              attrName, knxDest, knxFormat):
+        if not is_number(val):
+            raise FunctionError('wrong value type')
+        queue = self.queue
+        queue.append(float(val))
+        return queue.average()
+
+
+class _AvExtremeOperator(_QueueOperator):
+    """ avMax and avMin - returns the max/min value for a queue of values, also for boolean and On/Off values """
+
+    def __init__(self, statement: str, name: str):
+        super().__init__(statement, name)
+        self.isMax = name == 'avMax'
+
+    def apply(self, deviceInstance, dpt, val,
+              attrName, knxDest, knxFormat):
         if is_number(val):
-            queue.append(float(val))
-            # identify min value
-            for i in queue:
-                val = min(val, i)
+            num = float(val)
         elif is_bool(val):
-            queue.append(bool(val))
-            # identify false/true minimum
-            val = True
-            for i in queue:
-                if not i:
-                    val = False
-                    break
+            num = 1.0 if convert_bool(val) else 0.0
         elif type(val) == str and \
                 (val == 'Off' or val == 'On'):
-            # perform avMin execution by recursive call
-            if val == 'Off':
-                val = __executeFunctionImpl(deviceInstance, dpt, function, False,
-                                            attrName, knxDest, knxFormat)
-            else:
-                val = __executeFunctionImpl(deviceInstance, dpt, function, True,
-                                            attrName, knxDest, knxFormat)
-            # perform backward mapping to On/Off value
-            if val:
-                val = 'On'
-            else:
-                val = 'Off'
+            num = 1.0 if val == 'On' else 0.0
         else:
-            errDetail = 'wrong value type'
-    elif function[:2] == 'av':
-        # returns the average value for a queue of values
-        # queue values are dropped sequentially when capacity is hit
-        par = re.split("[,;]", function[3:-1])
-        # split function parameter - av(<queueID>,<FIFOsize>)
-        queueID = str(par[0])
-        # check existing of queueID and save current value
-        if not queueID in queueList:
-            # optional definition of queue size, e.g. multiple references to the same queue
-            if (len(par) > 1):
-                queueSize = int(par[1])
-            else:
-                # arbitrary value
-                queueSize = 10
-            queueList[queueID] = deque(maxlen=queueSize)
-        queue = queueList[queueID]
+            raise FunctionError('wrong value type')
 
+        queue = self.queue
+        queue.append(num)
+        extreme = queue.maximum() if self.isMax else queue.minimum()
         if is_number(val):
-            queue.append(float(val))
-            # calculate average
-            sum = 0
-            for i in queue:
-                sum = sum + i
-            val = sum / len(queue)
-        else:
-            errDetail = 'wrong value type'
-    elif function[:6] == 'eqExcl':
-        # checks if current value matches given value
-        # in case of string values simply put the pattern into brackets without further escaping
-        # example: eqExcl("Check against this string")
-        # return only True if matching, otherwise None for no further processing
-        # check for live KNX value
-        gv = function[7:-1]
-        if '/' in gv:
-            gv = deviceInstance.readKNXAttribute("functions live value",
-                                                 gv, knxFormat)
-        # start comparison
-        if is_number(val):
-            try:
-                if float(val) == convert_number(float(gv)):
-                    val = True
-                else:
-                    # indicate legitim None value
-                    val = NoneValueClass()
-            except ValueError:
-                errDetail = 'wrong function definition'
+            return extreme
         elif is_bool(val):
-            try:
-                if convert_bool(val) == convert_bool(gv):
-                    val = True
-                else:
-                    # indicate legitim None value
-                    val = NoneValueClass()
-            except ValueError:
-                errDetail = 'wrong function definition'
-        elif type(val) == str:
-            try:
-                if str(val) == str(gv):
-                    val = True
-                else:
-                    # indicate legitim None value
-                    val = NoneValueClass()
-            except ValueError:
-                errDetail = 'wrong function definition'
-        else:
-            errDetail = 'wrong value type'
-    elif function[:2] == 'eq':
-        # checks if current value matches given value, return either true or false
-        # check for live KNX value
-        gv = function[3:-1]
-        if '/' in gv:
-            gv = deviceInstance.readKNXAttribute("functions live value",
-                                                 gv, knxFormat)
+            return extreme > 0
+        # perform backward mapping to On/Off value
+        return 'On' if extreme > 0 else 'Off'
+
+
+class _EqOperator(FunctionOperator):
+    """
+    eq - checks if current value matches given value, return either true or false
+    eqExcl - return only True if matching, otherwise legitim None value for no further processing
+    in case of string values simply put the pattern into brackets without further escaping
+    """
+
+    def __init__(self, statement: str, exclusive: bool):
+        self.nameLength = 6 if exclusive else 2
+        super().__init__(statement)
+        self.exclusive = exclusive
+        self.reference = self.arg.strip() if '/' in self.arg else None
+
+    def apply(self, deviceInstance, dpt, val,
+              attrName, knxDest, knxFormat):
+        gv = _liveValue(deviceInstance, self.arg, knxFormat)
         # start comparison
-        if is_number(val):
-            try:
-                val = (float(val) == convert_number(float(gv)))
-            except ValueError:
-                errDetail = 'wrong function definition'
-        elif is_bool(val):
-            try:
-                val = (convert_bool(val) == convert_bool(gv))
-            except ValueError:
-                errDetail = 'wrong function definition'
-        elif type(val) == str:
-            try:
-                val = (str(val) == str(gv))
-            except ValueError:
-                errDetail = 'wrong function definition'
-        else:
-            errDetail = 'wrong value type'
-    elif function[:9] == 'timedelta':
-        # checks delta in seconds between now and given date
-        # :returns:   true if delta is outside defined delta in seconds
         try:
-            errDetail = 'wrong function definition'
-            delta = abs(int(function[12:-1]))
-            errDetail = 'wrong value type (date cannot be parsed)'
+            if is_number(val):
+                match = float(val) == convert_number(float(gv))
+            elif is_bool(val):
+                match = convert_bool(val) == convert_bool(gv)
+            elif type(val) == str:
+                match = str(val) == str(gv)
+            else:
+                raise FunctionError('wrong value type')
+        except (ValueError, TypeError, AttributeError):
+            raise FunctionError('wrong function definition')
+
+        if self.exclusive and not match:
+            # indicate legitim None value
+            return NoneValueClass()
+        return match
+
+
+class _TimedeltaOperator(FunctionOperator):
+    """
+    checks delta in seconds between now and given date
+    :returns:   true if delta is outside defined delta in seconds
+    """
+
+    def __init__(self, statement: str):
+        super().__init__(statement)
+        self.mode = statement[9:11]
+        self.delta = timedelta(seconds=abs(int(statement[12:-1])))
+
+    def apply(self, deviceInstance, dpt, val,
+              attrName, knxDest, knxFormat):
+        try:
             # retrieve both date value and set them to UTC for comparison
             timenow = datetime.now(timezone.utc)
-            clienttime = dateparser.parse(val)
-            if function[9:11] == 'LT':
-                val = timedelta(seconds=delta) > abs(timenow - clienttime)
-            elif function[9:11] == 'GT':
-                val = timedelta(seconds=delta) < abs(timenow - clienttime)
-            errDetail = None
-        except ValueError as ex:
-            errDetail += str(ex)
-    elif function[:7] == 'timechg':
-        # adds/deducts the defined delta in seconds to given date
-        # :returns:   the new time with the time in seconds added/deducted
+            clienttime = _parseDate(val)
+            if clienttime.tzinfo is None:
+                # deCONZ reports UTC without time zone designator
+                clienttime = clienttime.replace(tzinfo=timezone.utc)
+            if self.mode == 'LT':
+                return self.delta > abs(timenow - clienttime)
+            elif self.mode == 'GT':
+                return self.delta < abs(timenow - clienttime)
+            return val
+        except (ValueError, TypeError) as ex:
+            raise FunctionError('wrong value type (date cannot be parsed)' + str(ex))
+
+
+class _TimechgOperator(FunctionOperator):
+    """
+    adds/deducts the defined delta in seconds to given date
+    :returns:   the new time with the time in seconds added/deducted
+    """
+    nameLength = 7
+
+    def __init__(self, statement: str):
+        super().__init__(statement)
+        self.delta = timedelta(seconds=int(self.arg))
+
+    def apply(self, deviceInstance, dpt, val,
+              attrName, knxDest, knxFormat):
         try:
-            errDetail = 'wrong function definition'
-            delta = int(function[8:-1])
-            errDetail = 'wrong value type (no date)'
             # calculate time with delta and convert it to original value type
-            val = type(val)(dateparser.parse(val) + timedelta(seconds=delta))
-            errDetail = None
-        except ValueError:
-            pass
-    elif function[:6] == 'asynch':
-        # asynchronous method call with not interfere with current execution
-        # but it will start another thread after defined duration with defined value as function
-        # syntax: asynch(<duration in sec> <function call>)
-        # important: use blank as separator not comma or semicolon!
-        # examples: asynch(60 val(true))
+            return type(val)(_parseDate(val) + self.delta)
+        except (ValueError, TypeError):
+            raise FunctionError('wrong value type (no date)')
+
+
+class _AsynchOperator(FunctionOperator):
+    """
+    asynchronous method call with not interfere with current execution
+    but it will write the value of the defined function after defined duration via the central timer thread
+    syntax: asynch(<duration in sec>,<function call>), e.g. asynch(60,val(true))
+    every event for the same attribute and destination restarts a pending timer (retriggerable),
+    polled attributes restart it only if their value changed since the last update
+    """
+    nameLength = 6
+    stateful = True
+
+    def __init__(self, statement: str):
+        super().__init__(statement)
+        tok = re.split("[,;]", self.arg)
+        self.duration = int(tok[0])
+        self.pipeline = compileFunction(tok[1])
+        # last input value per attribute and destination, compared for polled values only
+        self.lastVal = {}
+
+    def apply(self, deviceInstance, dpt, val,
+              attrName, knxDest, knxFormat):
         try:
-            tok = re.split("[,;]", function[7:-1])
-            duration = tok[0]
-            func = tok[1]
-            asynchVal = executeFunction(deviceInstance,
-                                      dpt, func, val,
-                                      attrName, knxDest, knxFormat)
-            Timer(int(duration), _asynchWrite, kwargs={"deviceInstance": deviceInstance,
-                                                       "attrName": attrName,
-                                                       "knxDest": knxDest,
-                                                       "knxFormat": knxFormat,
-                                                       "val": asynchVal
-                                                       }).start()
+            asynchVal = self.pipeline.execute(deviceInstance,
+                                              dpt, val,
+                                              attrName, knxDest, knxFormat)
+            # several asynch statements of one chain are scheduled independently
+            key = (attrName, knxDest)
+            retrigger = not getattr(_evaluation, 'polled', False) or \
+                key not in self.lastVal or self.lastVal[key] != val
+            self.lastVal[key] = val
+            DelayedActionScheduler().schedule(('asynch', attrName, knxDest, self.statement), self.duration,
+                                              lambda: _asynchWrite(deviceInstance, attrName,
+                                                                   knxDest, knxFormat, asynchVal),
+                                              '{0}[{1}] {2}'.format(attrName, knxDest, self.statement),
+                                              retrigger)
         except Exception as e:
-            errDetail = 'Could not start asynchronous function - ' + str(e)
-    elif function[:8] == 'rgb_2_xy':
-        # converts an rgb list into a xy coordinate list
+            raise FunctionError('Could not start asynchronous function - ' + str(e))
+        return val
+
+
+class _ConversionOperator(FunctionOperator):
+    """ rgb_2_xy and oct_2_int value conversions """
+
+    def __init__(self, statement: str, convert, errDetail: str):
+        super().__init__(statement)
+        self.convert = convert
+        self.errDetail = errDetail
+
+    def apply(self, deviceInstance, dpt, val,
+              attrName, knxDest, knxFormat):
         try:
-            val = convert_val2xy(val)
-        except TypeError as e:
-            errDetail = 'Wrong value for color transformation'
-    elif function[:9] == 'oct_2_int':
-        oldVal = val
-        val = convert_oct2int(val)
-    if errDetail:
-        log('error',
-            'Could not apply function "{0}" to value {1} - {2}'.format(function,
-                                                                       val,
-                                                                       errDetail))
-    return val
+            return self.convert(val)
+        except (TypeError, ValueError, IndexError):
+            raise FunctionError(self.errDetail)
+
+
+class _NoOperator(FunctionOperator):
+    """ unknown function, value is passed unchanged """
+
+    def apply(self, deviceInstance, dpt, val,
+              attrName, knxDest, knxFormat):
+        return val
+
+
+def _compileStatement(statement: str) -> FunctionOperator:
+    """
+    :returns operator for one function statement, prefixes are checked in order of precedence, None if unknown
+    :raises ValueError, IndexError in case of invalid arguments
+    """
+    if statement[:3] == 'val':
+        return _ValOperator(statement)
+    elif statement[:3] == 'inv':
+        return _InvOperator(statement)
+    elif statement[:3] == 'max':
+        # returns the greater value, useful for greater 0 assurancce
+        return _ArithmeticOperator(statement, max)
+    elif statement[:3] == 'min':
+        return _ArithmeticOperator(statement, min)
+    elif statement[:3] == 'rnd':
+        # rounds the current value to the given precision
+        return _ArithmeticOperator(statement, lambda val, digits: round(val, int(digits)))
+    elif statement[:3] == 'div':
+        operator = _ArithmeticOperator(statement, lambda val, div: val / div)
+        if operator.operand == 0:
+            raise ValueError('divider is zero')
+        return operator
+    elif statement[:3] == 'mul':
+        return _ArithmeticOperator(statement, lambda val, mul: val * mul)
+    elif statement[:3] == 'add':
+        return _ArithmeticOperator(statement, lambda val, add: val + add)
+    elif statement[:3] == 'sub':
+        return _SubOperator(statement)
+    elif statement[:2] == 'lt':
+        return _CompareOperator(statement, lambda val, op: val < op)
+    elif statement[:2] == 'gt':
+        return _CompareOperator(statement, lambda val, op: val > op)
+    elif statement[:5] == 'avMax':
+        return _AvExtremeOperator(statement, 'avMax')
+    elif statement[:5] == 'avMin':
+        return _AvExtremeOperator(statement, 'avMin')
+    elif statement[:2] == 'av':
+        return _AvOperator(statement)
+    elif statement[:6] == 'eqExcl':
+        return _EqOperator(statement, True)
+    elif statement[:2] == 'eq':
+        return _EqOperator(statement, False)
+    elif statement[:9] == 'timedelta':
+        return _TimedeltaOperator(statement)
+    elif statement[:7] == 'timechg':
+        return _TimechgOperator(statement)
+    elif statement[:6] == 'asynch':
+        return _AsynchOperator(statement)
+    elif statement[:8] == 'rgb_2_xy':
+        # converts an rgb list into a xy coordinate list
+        return _ConversionOperator(statement, convert_val2xy, 'Wrong value for color transformation')
+    elif statement[:9] == 'oct_2_int':
+        return _ConversionOperator(statement, convert_oct2int, 'Wrong value for octet conversion')
+    return None
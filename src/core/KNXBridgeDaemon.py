@@ -16,7 +16,8 @@
 #     - attributes:
 #           -- list of attributes transferred between the ModBus appliance and the KNX bus
 #           -- script currently only supports ModBus-READ and KNX-WRITE instructions, defined by [type] value "modbus2knx"
-#           -- [modbusAddrDec] defines the ModBus address in decimal representation, [modbusFormat] the ModBus attribute data type - currently only "float" is supported
+#           -- [modbusAddrDec] defines the ModBus address in decimal representation, [modbusFormat] the ModBus attribute data type
+#              ("int16", "uint16", "int32", "uint32", "int64", "uint64", "float32", "float64", "string" or legacy "float"), optional [modbusScale] factor
 #           -- [modbusAddrDec] allows the automatic calculation of the sum of several ModBus addresses by "[addr1, addr2]" representation
 #           -- [knxAddr] defines the KNX address in "x/y/z" notation, [knxFormat] the KNX DPT data type
 #           -- [updFreq] defines the frequency the attribute is updated:
@@ -26,15 +27,22 @@
 #               --- "low"         - updates once every 24hours
 #
 #####################################################################################################################
-from threading import Timer
 from typing import Dict
 
+from core import Functions
 from core.DeviceBase import KNXGateway
 from core.DeviceKNX import KNX2KNXClient, KNX2KNXFactory
 from core.DeviceMQTT import MQTTAppliance
 from core.DeviceModBus import ModBusClient
-from core.DeviceZigBee import ZigBeeClient, ZigBeeGateway
+from core.DeviceZigBee import ZigBeeClient, ZigBeeGateway, ZigBeeGroupClient, ZIGBEETYPEDEF
+from core.ExecutionPlan import ExecutionPlan, ApplianceJob, ModBusTask, ZigBeeTask, KNX2KNXTask, ModBusJob, ZigBeeJob
+from core.Scheduler import UpdateScheduler, DelayedActionScheduler
 from core.util.BasicUtil import readConfig, setLogLevel, getAttrSafe, log
+from core.util.FunctionState import FunctionStateStore
+from core.util.KNXDCache import KNXGroupCache
+from core.util.KNXDConnection import KNXDConnection, KNXDSocketTransport
+from core.util.KNXDDependency import KNXDependencyGraph
+from core.util.KNXDQueue import KNXWriteQueue
 
 # dictionary for update frequency mask
 UPDATEFREQ: Dict[str, int] = {
@@ -47,6 +55,16 @@ UPDATEFREQ: Dict[str, int] = {
     "initial": 0xFF
 }
 
+# update period in seconds per update frequency mask
+UPDATEPERIOD: Dict[int, int] = {
+    UPDATEFREQ["critical"]: 3,          # ONLY USE IN EXCEPTIONABLE CASES!!
+    UPDATEFREQ["very high"]: 10,
+    UPDATEFREQ["high"]: 60,
+    UPDATEFREQ["medium"]: 600,
+    UPDATEFREQ["very low"]: 3600,
+    UPDATEFREQ["low"]: 86400
+}
+
 
 class KNXWriter:
 
@@ -60,19 +78,42 @@ class KNXWriter:
         #####   Get Gateway information #####
         # get KNXD TCP/Bus configuration
         KNXGateway().setHostIP(configuration['knxdAppliance']['knxdIP'])
+        # persistent connection used by all devices for group writes
+        KNXDConnection().initialize(KNXDSocketTransport(configuration['knxdAppliance']['knxdIP'],
+                                                        getAttrSafe(configuration['knxdAppliance'], 'knxdPort')))
+        # bus load budget for all outbound telegrams
+        KNXWriteQueue().initialize(getAttrSafe(configuration['knxdAppliance'], 'knxdRate'),
+                                   getAttrSafe(configuration['knxdAppliance'], 'knxdBurst'),
+                                   getAttrSafe(configuration['knxdAppliance'], 'knxdQueueSize'))
 
         # get ZigBee Gateway configuration
+        # identical knx2zigbee commands for several lights are mapped onto a deCONZ group
+        self.zigbeeFanOut = False
+        self.zigbeeCreateGroups = False
         if 'deconzAppliance' in configuration.keys():
+            self.zigbeeFanOut = getAttrSafe(configuration['deconzAppliance'], 'deConzFanOut') is not False
+            self.zigbeeCreateGroups = bool(getAttrSafe(configuration['deconzAppliance'], 'deConzCreateGroups'))
             ZigBeeGateway().initialize(configuration['deconzAppliance']['deConzIP'],
                                        configuration['deconzAppliance']['deConzPort'],
-                                       configuration['deconzAppliance']['deConzToken'])
+                                       configuration['deconzAppliance']['deConzToken'],
+                                       getAttrSafe(configuration['deconzAppliance'], 'deConzPush'),
+                                       getAttrSafe(configuration['deconzAppliance'], 'deConzWSPort'),
+                                       getAttrSafe(configuration['deconzAppliance'], 'deConzResync'),
+                                       getAttrSafe(configuration['deconzAppliance'], 'deConzTimeout'),
+                                       getAttrSafe(configuration['deconzAppliance'], 'deConzStateTTL'),
+                                       getAttrSafe(configuration['deconzAppliance'], 'deConzCoalesce'))
 
         #####   Get external client information #####
         # build up list of defined modbus clients
         self.modbusClients = {}
         for cc in configuration['modbusAppliance']:
             self.modbusClients[cc['modbusApplID']] = ModBusClient(cc['modbusIP'],
-                                                                  cc['modbusPort'])
+                                                                  cc['modbusPort'],
+                                                                  getAttrSafe(cc, 'modbusGap'),
+                                                                  getAttrSafe(cc, 'modbusUnit'),
+                                                                  getAttrSafe(cc, 'modbusByteOrder'),
+                                                                  getAttrSafe(cc, 'modbusWordOrder'),
+                                                                  getAttrSafe(cc, 'modbusTimeout'))
 
         # build up list of defined MQTT appliance
         # due to the self-contained (threaded) architecture of MQTT client, MQTT clients
@@ -82,7 +123,10 @@ class KNXWriter:
             self.mqttAppliances[cc['mqttApplID']] = MQTTAppliance(cc['mqttIP'],
                                                                   getAttrSafe(cc, 'mqttPort'),
                                                                   getAttrSafe(cc, 'mqttUser'),
-                                                                  getAttrSafe(cc, 'mqttPasswd'))
+                                                                  getAttrSafe(cc, 'mqttPasswd'),
+                                                                  getAttrSafe(cc, 'mqttQoS'),
+                                                                  getAttrSafe(cc, 'mqttRetain'),
+                                                                  getAttrSafe(cc, 'mqttBufferSize'))
 
         # build up list of defined zigbee devices
         self.zigbeeClients = {}
@@ -94,154 +138,248 @@ class KNXWriter:
         #####   Store list of client attributes #####
         # get update attribute list
         self.attrs = configuration['attributes']
+        # compiled during setup
+        self.plan = ExecutionPlan()
+        # zigbee2knx tasks per deCONZ type and id, triggered by push mode change events
+        self.zigbeeTasks = {}
+        self.zigbeeListener = None
+
+        # shadow all known group addresses via bus monitor instead of querying knxd for every comparison
+        KNXGroupCache().initialize(getAttrSafe(configuration['knxdAppliance'], 'knxdCacheTTL'))
+        for attr in self.attrs:
+            for key in ('knxAddr', 'knxDest'):
+                addr = getAttrSafe(attr, key)
+                # group definitions (list of addresses) are handled by their listeners
+                if isinstance(addr, str) and addr.find("[") == -1:
+                    KNXGroupCache().watch(addr)
 
         # verbosity level
         setLogLevel(configuration['configVerbose'])
 
-    def update(self, freq):
-        global UPDATEFREQ
+        # restore queueing function state of the last run before the queues are defined
+        FunctionStateStore().initialize(getAttrSafe(configuration, 'configQueueMax'),
+                                        getAttrSafe(configuration, 'configStateFile'),
+                                        getAttrSafe(configuration, 'configStateInterval'))
+        log('info', 'Restored {0} function queues from snapshot'.format(FunctionStateStore().load()))
+        self.stateSnapshot = None
+        DelayedActionScheduler().initialize(getAttrSafe(configuration, 'configAsynchMax'))
 
-        #####   initialization of clients #####
-        # ModBus clients will be implicitely update as part of the getAttribute call
+        # parse all function definitions once, definition errors are reported at startup
+        for attr in self.attrs:
+            if getAttrSafe(attr, 'function'):
+                pipeline = Functions.compileFunction(attr['function'])
+                for error in pipeline.errors:
+                    log('error',
+                        'Configuration error - "{0}": function {1}'.format(attr['name'], error))
+                # referenced KNX addresses are tracked via the bus monitor instead of being read per value
+                try:
+                    pipeline.subscribe()
+                except ValueError as ex:
+                    log('error',
+                        'Configuration error - "{0}": function {1}'.format(attr['name'], ex))
 
-        # initialize ZigBee Gateway with latest client state
-        if ZigBeeGateway().isActive():
-            ZigBeeGateway().getState()
+        # worker threads for concurrent appliance updates
+        UpdateScheduler().initialize(getAttrSafe(configuration, 'configWorkers'))
 
-        # iterate list of attributes to be updated
+    def setup(self):
+        """ first time initialization - sets up knx-based event triggers and listening clients """
+        zigbeeGrouped = self.setupZigBeeFanOut()
         for attr in self.attrs:
-
-            # first time initialization steps
-            if UPDATEFREQ['initial'] & freq == UPDATEFREQ['initial']:
-                # setup knx-based event trigger based on EIB/KNX client listener
-                # ModBus - currently not implemented
-                if attr['type'] == 'knx2modbus':
-                    raise NotImplementedError
-                # set up ZigBee listener
-                elif attr['type'] == 'knx2zigbee':
-                    # find corresponding ZigBee device
-                    if attr['zigbeeApplID'] in self.zigbeeClients:
-                        client = self.zigbeeClients[attr['zigbeeApplID']]
-                        client.installListener(attr['name'],
-                                               attr['knxAddr'], attr['knxFormat'],
-                                               attr['zigbeeAttr'], attr['zigbeeFormat'],
-                                               getAttrSafe(attr, 'zigbeeSection'), getAttrSafe(attr, 'function'))
-                elif attr['type'] == 'knx2knx':
-                    # initialize new client, implicitely setting up the listener during construction
-                    # usually KNX clients react to changes to the KNX source ('knxAddr') but can also define an update frequency explicitely
-                    client = KNX2KNXFactory.initializeClient(attr['name'],
-                                                               attr['knxAddr'], attr['knxFormat'],
-                                                               attr['knxDest'], getAttrSafe(attr, 'function'),
-                                                               getAttrSafe(attr, 'flags'))
-                elif attr['type'] == 'mqtt2knx':
-                    # mqtt client defines its own thread which permanently listens to update events
-                    # avoid registering to targets which flood your KNX bus due to high frequency of update
-                    if attr['mqttApplID'] in self.mqttAppliances:
-                        appliance = self.mqttAppliances[attr['mqttApplID']]
+            # setup knx-based event trigger based on EIB/KNX client listener
+            # ModBus - currently not implemented
+            if attr['type'] == 'knx2modbus':
+                raise NotImplementedError
+            # set up ZigBee listener
+            elif attr['type'] == 'knx2zigbee':
+                # find corresponding ZigBee device, attributes switched via a group need no listener of their own
+                if attr['zigbeeApplID'] in self.zigbeeClients and id(attr) not in zigbeeGrouped:
+                    client = self.zigbeeClients[attr['zigbeeApplID']]
+                    client.installListener(attr['name'],
+                                           attr['knxAddr'], attr['knxFormat'],
+                                           attr['zigbeeAttr'], attr['zigbeeFormat'],
+                                           getAttrSafe(attr, 'zigbeeSection'), getAttrSafe(attr, 'function'))
+            elif attr['type'] == 'knx2knx':
+                # initialize new client, implicitely setting up the listener during construction
+                # usually KNX clients react to changes to the KNX source ('knxAddr') but can also define an update frequency explicitely
+                client = KNX2KNXFactory.initializeClient(attr['name'],
+                                                           attr['knxAddr'], attr['knxFormat'],
+                                                           attr['knxDest'], getAttrSafe(attr, 'function'),
+                                                           getAttrSafe(attr, 'flags'))
+            elif attr['type'] == 'mqtt2knx':
+                # one subscription connection per broker permanently listens to update events
+                # avoid registering to targets which flood your KNX bus due to high frequency of update
+                if attr['mqttApplID'] in self.mqttAppliances:
+                    appliance = self.mqttAppliances[attr['mqttApplID']]
+                    try:
                         appliance.setupClient(attr['name'], attr['mqttTopic'],
                                               attr['knxAddr'], attr['knxFormat'],
                                               getAttrSafe(attr, 'mqttFormat'),
                                               getAttrSafe(attr, 'function'),
-                                              getAttrSafe(attr, 'flags'))
-
-            # check attribute update frequency matches current thread definition
-            if 'updFreq' in attr and UPDATEFREQ[attr['updFreq']] & freq > 0:
-
-                client = None
-                newVal = None
-                appliance = None
-
-                destAddr = getAttrSafe(attr, 'knxAddr')
-                destFormat = getAttrSafe(attr, 'knxFormat')
-
-                # check update type - currently only modbus read, knx write is supported
-                if attr['type'] == 'modbus2knx' or attr['type'] == 'modbus2mqtt':
-                    # find corresponding ModBus device
-                    if attr['modbusApplID'] in self.modbusClients:
-                        client = self.modbusClients[attr['modbusApplID']]
-
-                        # get latest ModBus value for attribute
-                        newVal = client.getAttribute(attr['name'],
-                                                     attr['modbusFormat'],
-                                                     attr['modbusAddrDec'])
-
-                        # define appliance and destination for sending MQTT updates
-                        if attr['type'] == 'modbus2mqtt':
-                            appliance = self.mqttAppliances[attr['mqttApplID']]
-                            destAddr = attr['mqttTopic']
-                            destFormat = None
-                    else:
+                                              getAttrSafe(attr, 'flags'),
+                                              getAttrSafe(attr, 'mqttMinInterval'),
+                                              getAttrSafe(attr, 'mqttDebounce'),
+                                              getAttrSafe(attr, 'mqttDeadband'),
+                                              getAttrSafe(attr, 'mqttDeadbandRel'),
+                                              getAttrSafe(attr, 'mqttPath'))
+                    except ValueError as ex:
                         log('error',
-                            'Configuration error - modbusApplID({0}) not defined'.format(attr['zigbeeApplID']))
-                # handle ZigBee attributes
-                elif attr['type'] == 'zigbee2knx' and ZigBeeGateway().isActive():
-                    # find corresponding ZigBee device
-                    if attr['zigbeeApplID'] in self.zigbeeClients:
-                        client = self.zigbeeClients[attr['zigbeeApplID']]
-
-                        # get latest ZigBee value for attribute
-                        newVal = client.getAttribute(attr['name'],
-                                                     attr['zigbeeFormat'],
-                                                     attr['zigbeeAttr'],
-                                                     getAttrSafe(attr, 'zigbeeSection'))
-                    else:
+                            'Configuration error - "{0}": {1}'.format(attr['name'], ex))
+
+        # knx2knx clients are available after listener setup
+        self.plan = self.compilePlan()
+
+        # subscribe to ZigBee change events, values are sent immediately on change
+        if ZigBeeGateway().isPushEnabled():
+            self.zigbeeListener = UpdateScheduler().runCoroutine(ZigBeeGateway().listen(self.onZigBeeChange))
+
+        # persist queueing function state for warm restarts
+        self.stateSnapshot = UpdateScheduler().runCoroutine(FunctionStateStore().snapshotPeriodically())
+
+    def setupZigBeeFanOut(self) -> set:
+        """
+        maps knx2zigbee attributes sharing KNX address, ZigBee attribute and function for several lights
+        onto one deCONZ group request, without a matching group the lights are updated concurrently
+        :returns    set of attribute object ids handled by group listeners
+        """
+        grouped = set()
+        if not self.zigbeeFanOut or not ZigBeeGateway().isActive():
+            return grouped
+
+        commands = {}
+        for attr in self.attrs:
+            if attr['type'] != 'knx2zigbee' or attr['zigbeeApplID'] not in self.zigbeeClients or \
+                    attr['knxAddr'].find("[") != -1:
+                continue
+            client = self.zigbeeClients[attr['zigbeeApplID']]
+            if client.deconzType != ZIGBEETYPEDEF[0]:
+                continue
+            key = (attr['knxAddr'], attr['knxFormat'],
+                   attr['zigbeeAttr'], attr['zigbeeFormat'],
+                   getAttrSafe(attr, 'zigbeeSection'), getAttrSafe(attr, 'function'))
+            commands.setdefault(key, []).append((attr, client))
+
+        for key, members in commands.items():
+            clients = list({str(client.deconzID): client for attr, client in members}.values())
+            if len(clients) < 2:
+                continue
+            groupID = ZigBeeGateway().findGroup([client.deconzID for client in clients],
+                                                'KNXBridge {0}'.format(key[0]),
+                                                self.zigbeeCreateGroups)
+            if groupID is None:
+                continue
+
+            group = ZigBeeGroupClient('KNXBridge {0}'.format(key[0]), groupID, clients)
+            group.installListener(members[0][0]['name'], *key)
+            grouped.update(id(attr) for attr, client in members)
+            log('info',
+                'ZigBee attribute "{0}" for {1} lights sent via group {2}'.format(key[2], len(clients), groupID))
+
+        return grouped
+
+    def shutdown(self):
+        """ sends pending telegrams and closes appliance connections """
+        if self.zigbeeListener is not None:
+            self.zigbeeListener.cancel()
+        if self.stateSnapshot is not None:
+            self.stateSnapshot.cancel()
+        FunctionStateStore().save()
+        for key, remaining, description in DelayedActionScheduler().getPending():
+            log('warning', 'Delayed action discarded on shutdown "{0}" due in {1:.1f}s'.format(description, remaining))
+        DelayedActionScheduler().stop()
+        log('info', 'Delayed action statistics: {0}'.format(DelayedActionScheduler().getStatistics()))
+        log('info', 'Function reference statistics: {0}'.format(KNXDependencyGraph().getStatistics()))
+
+        KNXWriteQueue().stop()
+        KNXDConnection().close()
+        log('info', 'KNX write queue statistics: {0}'.format(KNXWriteQueue().getStatistics()))
+
+        if ZigBeeGateway().isActive():
+            ZigBeeGateway().close()
+            log('info', 'ZigBee gateway statistics: {0}'.format(ZigBeeGateway().getStatistics()))
+
+        for applID, client in self.modbusClients.items():
+            client.close()
+            log('info', 'ModBus appliance {0} statistics: {1}'.format(applID, client.getStatistics()))
+
+        for applID, appliance in self.mqttAppliances.items():
+            appliance.close()
+            log('info', 'MQTT appliance {0} statistics: {1}'.format(applID, appliance.getStatistics()))
+
+    def onZigBeeChange(self, type, id):
+        """ called within event loop for each ZigBee client changed according to the event stream """
+        tasks = self.zigbeeTasks.get((type, str(id)))
+        if tasks:
+            UpdateScheduler().loop.run_in_executor(None, ApplianceJob('zigbee:{0}/{1}'.format(type, id), tasks))
+
+    def getUpdateJobs(self, freq) -> Dict[str, ApplianceJob]:
+        """
+        returns the precompiled jobs for attributes due for given frequency mask
+        :returns    dictionary of appliance name and job, jobs of different appliances may run concurrently
+        """
+        return self.plan.getJobs(freq)
+
+    def compilePlan(self) -> ExecutionPlan:
+        """ resolves all polled attributes into per-frequency buckets of tasks grouped by appliance """
+        global UPDATEFREQ
+
+        plan = ExecutionPlan()
+        self.zigbeeTasks = {}
+        for attr in self.attrs:
+            zigbeeTask = None
+            # zigbee2knx attributes are triggered by change events in push mode, update frequency is optional
+            if attr['type'] == 'zigbee2knx' and ZigBeeGateway().isPushEnabled() and \
+                    attr['zigbeeApplID'] in self.zigbeeClients:
+                client = self.zigbeeClients[attr['zigbeeApplID']]
+                zigbeeTask = ZigBeeTask(attr, client)
+                self.zigbeeTasks.setdefault((client.deconzType, str(client.deconzID)), []).append(zigbeeTask)
+
+            if 'updFreq' not in attr:
+                continue
+            if attr['updFreq'] not in UPDATEFREQ:
+                log('error',
+                    'Configuration error - updFreq "{0}" not defined for "{1}"'.format(attr['updFreq'], attr['name']))
+                continue
+            freq = UPDATEFREQ[attr['updFreq']]
+
+            # check update type - currently only modbus read, knx write is supported
+            if attr['type'] == 'modbus2knx' or attr['type'] == 'modbus2mqtt':
+                # find corresponding ModBus device
+                if attr['modbusApplID'] in self.modbusClients:
+                    appliance = None
+                    if attr['type'] == 'modbus2mqtt':
+                        appliance = self.mqttAppliances[attr['mqttApplID']]
+                    try:
+                        plan.add(freq, 'modbus:{0}'.format(attr['modbusApplID']),
+                                 ModBusTask(attr, self.modbusClients[attr['modbusApplID']], appliance), ModBusJob)
+                    except ValueError as ex:
                         log('error',
-                            'Configuration error - zigbeeApplID({0}) not defined'.format(attr['zigbeeApplID']))
-                # handle knx attributes that explicitly define an update frequency
-                # normal knx client reacts to changes to the knx source address
-                elif attr['type'] == 'knx2knx':
-                    # get defined knx client
-                    client = KNX2KNXFactory.getClient(attr['name'])
-                    # knx2knx protocal foresees 'knxAddr' as the source and 'knxDest' as the destination
-                    destAddr = getAttrSafe(attr, 'knxDest')
-                    # get current value of source address
-                    newVal = client.getSrcValue()
-
-                # write value to bus
-                if client is not None and newVal is not None:
-                    client.writeAttribute(attr['type'],
-                                             attr['name'],
-                                             destAddr,
-                                             destFormat,
-                                             newVal,
-                                             getAttrSafe(attr, 'function'),
-                                             getAttrSafe(attr, 'flags'),
-                                             appliance)
-
-        # run periodically update of values - each update frequency initiating its own thread
-        # initial run by main will initiate all threads at once
-        ut = None
-        if freq & UPDATEFREQ['critical'] > 0:
-            # CRITICAL - runs every 3 seconds - ONLY USE IN EXCEPTIONABLE CASES!!
-            ut = Timer(3, gateway.update, (UPDATEFREQ['critical'],))
-            ut.start()
-        if freq & UPDATEFREQ['very high'] > 0:
-            # VERY HIGH - runs every 10 seconds
-            ut = Timer(10, gateway.update, (UPDATEFREQ['very high'],))
-            ut.start()
-        if freq & UPDATEFREQ['high'] > 0:
-            # HIGH - runs every 60 seconds
-            Timer(60, gateway.update, (UPDATEFREQ['high'],)).start()
-        if freq & UPDATEFREQ['medium'] > 0:
-            # MEDIUM - runs every 10 minutes
-            Timer(600, gateway.update, (UPDATEFREQ['medium'],)).start()
-        if freq & UPDATEFREQ['very low'] > 0:
-            # LOW - runs every 60 minutes
-            Timer(3600, gateway.update, (UPDATEFREQ['very low'],)).start()
-        if freq & UPDATEFREQ['low'] > 0:
-            # LOW - runs every 24 hours
-            Timer(86400, gateway.update, (UPDATEFREQ['low'],)).start()
-
-        # return reference to very high thread for synchronization
-        return ut
+                            'Configuration error - "{0}": {1}'.format(attr['name'], ex))
+                else:
+                    log('error',
+                        'Configuration error - modbusApplID({0}) not defined'.format(attr['modbusApplID']))
+            # handle ZigBee attributes
+            elif attr['type'] == 'zigbee2knx' and ZigBeeGateway().isActive():
+                # find corresponding ZigBee device
+                if attr['zigbeeApplID'] in self.zigbeeClients:
+                    # share task with push mode to keep track of processed changes
+                    if zigbeeTask is None:
+                        zigbeeTask = ZigBeeTask(attr, self.zigbeeClients[attr['zigbeeApplID']])
+                    plan.add(freq, 'zigbee', zigbeeTask, ZigBeeJob)
+                else:
+                    log('error',
+                        'Configuration error - zigbeeApplID({0}) not defined'.format(attr['zigbeeApplID']))
+            # handle knx attributes that explicitly define an update frequency
+            # normal knx client reacts to changes to the knx source address
+            elif attr['type'] == 'knx2knx':
+                plan.add(freq, 'knx2knx',
+                         KNX2KNXTask(attr, KNX2KNXFactory.getClient(attr['name'])))
 
+        log('info', 'Execution plan compiled for {0} attributes'.format(len(plan)))
+        return plan
 
 if __name__ == '__main__':
     # initialize modbus2knxd gateway
     gateway = KNXWriter()
-    # initiate update process - update is self-iterating by starting various timer threads
-    thread = gateway.update(UPDATEFREQ['initial'])
-
-    # keep on running... the update thread will run forever
-    # https://blog.miguelgrinberg.com/post/how-to-make-python-wait
-    thread.join()
+    # run all update frequencies on the central event loop - initial run will update all attributes at once
+    # keep on running until the daemon is stopped via SIGTERM/SIGINT
+    UpdateScheduler().run(gateway, UPDATEPERIOD, UPDATEFREQ['initial'])
@@ -0,0 +1,289 @@
+import asyncio
+import heapq
+import itertools
+import math
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core.util.BasicUtil import log
+
+# default number of worker threads executing blocking appliance requests
+SCHEDULER_DEFAULT_WORKERS = 8
+# default max number of pending delayed actions
+DELAYED_DEFAULT_MAX = 1000
+
+
+class UpdateScheduler:
+    """
+    central singleton event loop engine running all polling frequency classes at a fixed rate
+    appliance jobs of one tick run concurrently in a worker pool, overruns are reported and missed ticks skipped
+    """
+    __instance = None
+    __loop = None
+    __stopEvent = None
+    __executor = None
+    __workers = SCHEDULER_DEFAULT_WORKERS
+    # appliances whose update exceeded its timeout and is still running
+    __hung = set()
+
+    def __new__(cls, *args, **kwargs):
+        if UpdateScheduler.__instance is None:
+            UpdateScheduler.__instance = object.__new__(cls)
+        return UpdateScheduler.__instance
+
+    @staticmethod
+    def initialize(workers=None):
+        """ defines number of worker threads for blocking appliance requests """
+        if workers:
+            UpdateScheduler.__workers = int(workers)
+
+    @property
+    def loop(self):
+        """ running event loop or None if scheduler was not started """
+        return UpdateScheduler.__loop
+
+    def isRunning(self) -> bool:
+        return UpdateScheduler.__loop is not None and UpdateScheduler.__loop.is_running()
+
+    def runCoroutine(self, coro):
+        """
+        submits coroutine from any thread to the scheduler loop
+        :returns concurrent.futures.Future or None if scheduler is not running
+        """
+        if not self.isRunning():
+            coro.close()
+            return None
+        return asyncio.run_coroutine_threadsafe(coro, UpdateScheduler.__loop)
+
+    def run(self, gateway, periods: dict, initialFreq: int):
+        """
+        blocks until shut down by SIGTERM/SIGINT
+        :param gateway:     provides setup(), getUpdateJobs(freq) and shutdown()
+        :param periods:     update frequency mask to period in seconds
+        :param initialFreq: frequency mask used for the first pass after setup
+        """
+        asyncio.run(self.__main(gateway, periods, initialFreq))
+
+    def stop(self):
+        """ thread-safe request to shut down the scheduler """
+        if self.isRunning():
+            UpdateScheduler.__loop.call_soon_threadsafe(UpdateScheduler.__stopEvent.set)
+
+    #########################################
+    #   event loop implementation           #
+    #########################################
+    async def __main(self, gateway, periods, initialFreq):
+        UpdateScheduler.__loop = asyncio.get_running_loop()
+        UpdateScheduler.__stopEvent = asyncio.Event()
+        UpdateScheduler.__executor = ThreadPoolExecutor(max_workers=UpdateScheduler.__workers,
+                                                        thread_name_prefix='KNXBridgeWorker')
+        UpdateScheduler.__loop.set_default_executor(UpdateScheduler.__executor)
+
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                UpdateScheduler.__loop.add_signal_handler(sig, UpdateScheduler.__stopEvent.set)
+            except (NotImplementedError, RuntimeError):
+                # not supported on this platform or not running in main thread
+                pass
+
+        try:
+            # install listeners and perform first update of all attributes
+            gateway.setup()
+            await self.__tick(gateway, initialFreq)
+
+            tasks = [asyncio.ensure_future(self.__runFrequency(gateway, freq, period))
+                     for freq, period in periods.items()]
+            await UpdateScheduler.__stopEvent.wait()
+
+            log('info', 'Shutting down update scheduler')
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            await UpdateScheduler.__loop.run_in_executor(None, gateway.shutdown)
+            UpdateScheduler.__executor.shutdown(wait=False)
+            UpdateScheduler.__loop = None
+
+    async def __runFrequency(self, gateway, freq, period):
+        """ fixed rate loop for one frequency class, next tick is computed from the schedule not from the pass end """
+        nextTick = UpdateScheduler.__loop.time() + period
+        while True:
+            await asyncio.sleep(max(0, nextTick - UpdateScheduler.__loop.time()))
+
+            start = UpdateScheduler.__loop.time()
+            await self.__tick(gateway, freq)
+            duration = UpdateScheduler.__loop.time() - start
+
+            nextTick += period
+            now = UpdateScheduler.__loop.time()
+            if now > nextTick:
+                # overrun - skip the ticks that were missed instead of running them back to back
+                missed = math.ceil((now - nextTick) / period)
+                nextTick += missed * period
+                log('warning',
+                    'Update cycle with frequency mask {0:#04x} overran: {1:.2f}s for period of {2}s, skipped {3} tick(s)'.format(
+                        freq, duration, period, missed))
+
+    async def __tick(self, gateway, freq):
+        """ runs all appliance jobs due for frequency mask concurrently, tick latency is the slowest appliance """
+        jobs = gateway.getUpdateJobs(freq)
+        if not jobs:
+            return
+
+        await asyncio.gather(*[self.__runJob(name, job) for name, job in jobs.items()])
+
+    async def __runJob(self, name, job):
+        """ runs job in worker pool, jobs exceeding their timeout keep their worker but are not awaited """
+        if name in UpdateScheduler.__hung:
+            # avoid piling up workers for an appliance that is still blocked
+            log('warning',
+                'Update of appliance "{0}" skipped, previous update still running'.format(name))
+            return
+
+        future = UpdateScheduler.__loop.run_in_executor(None, job)
+        try:
+            # shield keeps the worker future alive in case of a timeout
+            await asyncio.wait_for(asyncio.shield(future), getattr(job, 'timeout', None))
+        except asyncio.TimeoutError:
+            UpdateScheduler.__hung.add(name)
+            future.add_done_callback(lambda f: UpdateScheduler.__hung.discard(name))
+            log('warning',
+                'Update of appliance "{0}" exceeded timeout of {1:.1f}s'.format(name, job.timeout))
+        except Exception as ex:
+            log('error',
+                'Update of appliance "{0}" failed: {1}'.format(name, ex))
+
+
+class DelayedActionScheduler:
+    """
+    central singleton executing delayed actions (e.g. asynch function writes) in one timer thread
+    actions are keyed, scheduling an action for a pending key restarts its timer (retriggerable)
+    """
+    __instance = None
+    __cond = threading.Condition()
+    # key -> (due time, sequence number, callback, description)
+    __pending = {}
+    # heap of (due time, sequence number, key), superseded entries are skipped lazily
+    __heap = []
+    __seq = itertools.count()
+    __worker = None
+    __running = False
+    __maxPending = DELAYED_DEFAULT_MAX
+    __stats = {'scheduled': 0, 'retriggered': 0, 'cancelled': 0, 'executed': 0, 'rejected': 0, 'failed': 0}
+
+    def __new__(cls, *args, **kwargs):
+        if DelayedActionScheduler.__instance is None:
+            DelayedActionScheduler.__instance = object.__new__(cls)
+        return DelayedActionScheduler.__instance
+
+    @staticmethod
+    def initialize(maxPending=None):
+        """ defines max number of pending actions """
+        if maxPending:
+            DelayedActionScheduler.__maxPending = int(maxPending)
+
+    def schedule(self, key, delay: float, callback, description: str = None, retrigger: bool = True) -> bool:
+        """
+        executes callback after delay seconds, replaces a pending action with the same key
+        :param retrigger:   false keeps a pending action with the same key and its timer untouched
+        :returns false if the action was rejected due to the max number of pending actions
+        """
+        with DelayedActionScheduler.__cond:
+            if key in DelayedActionScheduler.__pending:
+                if not retrigger:
+                    return True
+                DelayedActionScheduler.__stats['retriggered'] += 1
+            elif len(DelayedActionScheduler.__pending) >= DelayedActionScheduler.__maxPending:
+                DelayedActionScheduler.__stats['rejected'] += 1
+                log('warning',
+                    'Max number of {0} delayed actions reached, rejected "{1}"'.format(
+                        DelayedActionScheduler.__maxPending, description or key))
+                return False
+
+            due = time.monotonic() + delay
+            seq = next(DelayedActionScheduler.__seq)
+            DelayedActionScheduler.__pending[key] = (due, seq, callback, description)
+            heapq.heappush(DelayedActionScheduler.__heap, (due, seq, key))
+            DelayedActionScheduler.__stats['scheduled'] += 1
+            DelayedActionScheduler.__start()
+            DelayedActionScheduler.__cond.notify()
+        return True
+
+    def cancel(self, key) -> bool:
+        """ :returns true if a pending action was cancelled """
+        with DelayedActionScheduler.__cond:
+            if DelayedActionScheduler.__pending.pop(key, None) is None:
+                return False
+            DelayedActionScheduler.__stats['cancelled'] += 1
+        return True
+
+    def getPending(self) -> list:
+        """ :returns list of (key, seconds until execution, description) ordered by execution time """
+        now = time.monotonic()
+        with DelayedActionScheduler.__cond:
+            pending = [(key, max(0.0, due - now), description)
+                       for key, (due, seq, callback, description) in DelayedActionScheduler.__pending.items()]
+        return sorted(pending, key=lambda action: action[1])
+
+    def getStatistics(self) -> dict:
+        """ returns counters for scheduled, retriggered, cancelled, executed, rejected and failed actions """
+        with DelayedActionScheduler.__cond:
+            stats = dict(DelayedActionScheduler.__stats)
+            stats['pending'] = len(DelayedActionScheduler.__pending)
+        return stats
+
+    def stop(self):
+        """ stops timer thread, pending actions are discarded """
+        with DelayedActionScheduler.__cond:
+            DelayedActionScheduler.__running = False
+            DelayedActionScheduler.__cond.notify_all()
+        if DelayedActionScheduler.__worker is not None:
+            DelayedActionScheduler.__worker.join()
+            DelayedActionScheduler.__worker = None
+
+    #########################################
+    #   timer thread                        #
+    #########################################
+    @staticmethod
+    def __start():
+        # lock held by caller
+        if DelayedActionScheduler.__running:
+            return
+        DelayedActionScheduler.__running = True
+        DelayedActionScheduler.__worker = threading.Thread(target=DelayedActionScheduler.__run,
+                                                           name='DelayedActions', daemon=True)
+        DelayedActionScheduler.__worker.start()
+
+    @staticmethod
+    def __run():
+        heap = DelayedActionScheduler.__heap
+        pending = DelayedActionScheduler.__pending
+        while True:
+            with DelayedActionScheduler.__cond:
+                while True:
+                    if not DelayedActionScheduler.__running:
+                        return
+                    # drop entries of retriggered or cancelled actions
+                    while heap and pending.get(heap[0][2], (None, None))[1] != heap[0][1]:
+                        heapq.heappop(heap)
+                    if not heap:
+                        DelayedActionScheduler.__cond.wait()
+                        continue
+                    wait = heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    DelayedActionScheduler.__cond.wait(wait)
+
+                due, seq, key = heapq.heappop(heap)
+                callback, description = pending.pop(key)[2:]
+
+            # execute outside of lock, callbacks may schedule further actions
+            try:
+                callback()
+                DelayedActionScheduler.__stats['executed'] += 1
+            except Exception as ex:
+                DelayedActionScheduler.__stats['failed'] += 1
+                log('error',
+                    'Delayed action "{0}" failed: {1}'.format(description or key, ex))
@@ -1,5 +1,7 @@
 import os
-from datetime import datetime
+import re
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict
 
@@ -167,6 +169,48 @@ def convert_oct2int(val):
     return int(b, 16)
 
 
+#################################
+#   Date helper methods         #
+#################################
+# ISO-8601 timestamps as used by deCONZ, e.g. '2021-03-01T12:00:00.123', '2021-03-01 12:00:00Z' or '...+01:00'
+ISODATETIME = re.compile(r"(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:[.,](\d+))?)?)?"
+                         r"\s*(Z|[+-]\d{2}(?::?\d{2})?)?")
+
+
+def parse_datetime(val: str):
+    """
+    parses ISO-8601 timestamps via the standard library, free-form dates via dateparser
+    timestamps without time zone are returned as naive datetime
+    :returns datetime or None if val cannot be parsed
+    """
+    match = ISODATETIME.fullmatch(val.strip())
+    if match is None:
+        # heavy import, only required for free-form input
+        # not cached, relative dates like "5 minutes ago" depend on the current time
+        import dateparser
+        return dateparser.parse(val)
+    return _parse_isodatetime(match.groups())
+
+
+@lru_cache(maxsize=256)
+def _parse_isodatetime(groups: tuple):
+    year, month, day, hour, minute, second, fraction, tz = groups
+    try:
+        ret = datetime(int(year), int(month), int(day),
+                       int(hour or 0), int(minute or 0), int(second or 0),
+                       int((fraction or '0')[:6].ljust(6, '0')))
+    except ValueError:
+        return None
+
+    if tz == 'Z':
+        ret = ret.replace(tzinfo=timezone.utc)
+    elif tz:
+        offset = tz[1:].replace(':', '')
+        delta = timedelta(hours=int(offset[:2]), minutes=int(offset[2:] or 0))
+        ret = ret.replace(tzinfo=timezone(delta if tz[0] == '+' else -delta))
+    return ret
+
+
 #################################
 #           Helper class        #
 #################################
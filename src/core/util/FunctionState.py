@@ -0,0 +1,253 @@
+import asyncio
+import os
+import struct
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+
+from core.util.BasicUtil import log, HOMEDIR
+
+# default number of values of a queue
+QUEUE_DEFAULT_SIZE = 10
+# number of values after which the running sum is recalculated to avoid floating point drift
+QUEUE_RESUM_INTERVAL = 10000
+# default max number of queues kept, least recently used queues are dropped beyond
+QUEUE_DEFAULT_MAX = 1000
+# default interval in seconds for writing the snapshot
+STATE_DEFAULT_SNAPSHOT = 300
+STATE_DEFAULT_PATH = HOMEDIR + "functionstate.bin"
+# snapshot file - magic, version, save time, number of queues
+STATE_HEADER = struct.Struct('<4sHdI')
+# per queue - id length, size, duration, number of values followed by (age, value) pairs as doubles
+STATE_QUEUE = struct.Struct('<HidI')
+STATE_MAGIC = b'KNXQ'
+STATE_VERSION = 1
+
+
+class RollingWindow:
+    """
+    thread-safe rolling window of numeric values bounded by number of values and/or age in seconds
+    average, maximum and minimum are maintained incrementally - running sum and monotonic deques
+    """
+
+    def __init__(self, size=None, duration=None):
+        self.size = size
+        self.duration = duration
+        self.__lock = threading.Lock()
+        # (sequence number, timestamp, value)
+        self.__values = deque()
+        # candidates for max/min - values decreasing/increasing from front to back
+        self.__max = deque()
+        self.__min = deque()
+        self.__sum = 0.0
+        self.__seq = 0
+
+    def configure(self, size=None, duration=None):
+        """ applies an explicit definition of another reference to the same queue """
+        with self.__lock:
+            if size:
+                self.size = size
+            if duration:
+                self.duration = duration
+            self.__evict(time.monotonic())
+
+    def append(self, val: float, now=None):
+        """ adds value and drops values beyond the window boundaries """
+        if now is None:
+            now = time.monotonic()
+        with self.__lock:
+            self.__seq += 1
+            self.__values.append((self.__seq, now, val))
+            self.__sum += val
+            while self.__max and self.__max[-1][1] <= val:
+                self.__max.pop()
+            self.__max.append((self.__seq, val))
+            while self.__min and self.__min[-1][1] >= val:
+                self.__min.pop()
+            self.__min.append((self.__seq, val))
+
+            self.__evict(now)
+            if self.__seq % QUEUE_RESUM_INTERVAL == 0:
+                self.__sum = sum(v for seq, t, v in self.__values)
+
+    def __evict(self, now):
+        # lock held by caller, the latest value always remains
+        size = self.size if self.size or self.duration else QUEUE_DEFAULT_SIZE
+        while len(self.__values) > 1 and \
+                ((size and len(self.__values) > size) or
+                 (self.duration and now - self.__values[0][1] > self.duration)):
+            seq, t, v = self.__values.popleft()
+            self.__sum -= v
+            if self.__max[0][0] == seq:
+                self.__max.popleft()
+            if self.__min[0][0] == seq:
+                self.__min.popleft()
+
+    def average(self) -> float:
+        with self.__lock:
+            return self.__sum / len(self.__values)
+
+    def maximum(self) -> float:
+        with self.__lock:
+            return self.__max[0][1]
+
+    def minimum(self) -> float:
+        with self.__lock:
+            return self.__min[0][1]
+
+    def __len__(self):
+        return len(self.__values)
+
+    def snapshot(self, now=None) -> list:
+        """ :returns list of (age in seconds, value) from oldest to latest """
+        if now is None:
+            now = time.monotonic()
+        with self.__lock:
+            return [(now - t, v) for seq, t, v in self.__values]
+
+    def restore(self, values, now=None):
+        """ appends values given as (age in seconds, value) from oldest to latest """
+        if now is None:
+            now = time.monotonic()
+        for age, val in values:
+            self.append(val, now - age)
+
+
+class FunctionStateStore:
+    """
+    central singleton holding the rolling windows of queueing functions per queue id
+    bounded by least recently used eviction, snapshots are written to disk for warm restarts
+    """
+    __instance = None
+    __queues = OrderedDict()
+    __lock = threading.Lock()
+    __maxQueues = QUEUE_DEFAULT_MAX
+    __path = STATE_DEFAULT_PATH
+    __interval = STATE_DEFAULT_SNAPSHOT
+
+    def __new__(cls, *args, **kwargs):
+        if FunctionStateStore.__instance is None:
+            FunctionStateStore.__instance = object.__new__(cls)
+        return FunctionStateStore.__instance
+
+    @staticmethod
+    def initialize(maxQueues=None, path=None, interval=None):
+        """ defines max number of queues, snapshot file (empty to disable) and snapshot interval in seconds """
+        if maxQueues:
+            FunctionStateStore.__maxQueues = int(maxQueues)
+        if path is not None:
+            FunctionStateStore.__path = os.path.expanduser(path)
+        if interval:
+            FunctionStateStore.__interval = float(interval)
+
+    @property
+    def interval(self) -> float:
+        return FunctionStateStore.__interval
+
+    def define(self, queueID: str, size=None, duration=None) -> RollingWindow:
+        """
+        registers definition of a queue reference, the window size is taken from any reference defining it
+        """
+        with FunctionStateStore.__lock:
+            queue = self.__lookup(queueID, size, duration)
+            if size or duration:
+                if (size and queue.size and queue.size != size) or \
+                        (duration and queue.duration and queue.duration != duration):
+                    log('warning',
+                        'Queue "{0}" defined with different sizes, using latest definition'.format(queueID))
+                queue.configure(size, duration)
+        return queue
+
+    def get(self, queueID: str, size=None, duration=None) -> RollingWindow:
+        """ returns window of queue id, recreated with the given boundaries if it was dropped """
+        with FunctionStateStore.__lock:
+            return self.__lookup(queueID, size, duration)
+
+    def __lookup(self, queueID, size, duration) -> RollingWindow:
+        # lock held by caller
+        queue = FunctionStateStore.__queues.get(queueID)
+        if queue is None:
+            queue = RollingWindow(size, duration)
+            FunctionStateStore.__queues[queueID] = queue
+            while len(FunctionStateStore.__queues) > FunctionStateStore.__maxQueues:
+                dropped, _ = FunctionStateStore.__queues.popitem(last=False)
+                log('warning',
+                    'Queue limit of {0} reached, dropped least recently used queue "{1}"'.format(
+                        FunctionStateStore.__maxQueues, dropped))
+        else:
+            FunctionStateStore.__queues.move_to_end(queueID)
+        return queue
+
+    def __len__(self):
+        return len(FunctionStateStore.__queues)
+
+    #########################################
+    #   snapshot for warm restarts          #
+    #########################################
+    def save(self) -> bool:
+        """ writes all windows to the snapshot file, replaced atomically """
+        path = FunctionStateStore.__path
+        if not path:
+            return False
+
+        with FunctionStateStore.__lock:
+            queues = list(FunctionStateStore.__queues.items())
+
+        now = time.monotonic()
+        tmpPath = path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmpPath, 'wb') as stream:
+                stream.write(STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, time.time(), len(queues)))
+                for queueID, queue in queues:
+                    key = queueID.encode('utf-8')
+                    values = queue.snapshot(now)
+                    stream.write(STATE_QUEUE.pack(len(key), queue.size or 0, queue.duration or 0, len(values)))
+                    stream.write(key)
+                    array('d', (x for pair in values for x in pair)).tofile(stream)
+            os.replace(tmpPath, path)
+        except OSError as ex:
+            log('error',
+                'Could not write function state snapshot {0}: {1}'.format(path, ex))
+            return False
+        return True
+
+    async def snapshotPeriodically(self):
+        """ writes the snapshot within the configured interval, runs within the scheduler loop """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(FunctionStateStore.__interval)
+            await loop.run_in_executor(None, self.save)
+
+    def load(self) -> int:
+        """
+        restores windows from the snapshot file, ages include the time the daemon was down
+        :returns number of restored queues
+        """
+        path = FunctionStateStore.__path
+        if not path or not os.path.isfile(path):
+            return 0
+
+        restored = 0
+        try:
+            with open(path, 'rb') as stream:
+                magic, version, savedAt, count = STATE_HEADER.unpack(stream.read(STATE_HEADER.size))
+                if magic != STATE_MAGIC or version != STATE_VERSION:
+                    raise ValueError('unsupported file format')
+                downtime = max(0.0, time.time() - savedAt)
+                now = time.monotonic()
+
+                for i in range(count):
+                    keyLen, size, duration, numValues = STATE_QUEUE.unpack(stream.read(STATE_QUEUE.size))
+                    queueID = stream.read(keyLen).decode('utf-8')
+                    data = array('d')
+                    data.fromfile(stream, 2 * numValues)
+
+                    queue = self.get(queueID, size or None, duration or None)
+                    queue.restore(((data[j] + downtime, data[j + 1]) for j in range(0, len(data), 2)), now)
+                    restored += 1
+        except (OSError, EOFError, ValueError, struct.error, UnicodeDecodeError) as ex:
+            log('error',
+                'Could not read function state snapshot {0}: {1}'.format(path, ex))
+        return restored
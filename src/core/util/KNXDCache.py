@@ -0,0 +1,89 @@
+import threading
+import time
+
+from EIBClient import EIBClientFactory, EIBClientListener
+from common import printValue
+from core.util.BasicUtil import log
+from core.util.KNXDConnection import knxAddrToInt
+
+# default time in seconds a cached group value is trusted before knxd is asked again
+KNXCACHE_DEFAULT_TTL = 600
+
+
+class KNXGroupCache:
+    """
+    central singleton shadowing the last raw value per KNX group address
+    fed by the EIB/KNX bus monitor and by our own group writes, replaces 'knxtool groupcacheread' calls
+    """
+    __instance = None
+    __values = {}
+    __listeners = {}
+    __ttl = KNXCACHE_DEFAULT_TTL
+    __lock = threading.Lock()
+
+    def __new__(cls, *args, **kwargs):
+        if KNXGroupCache.__instance is None:
+            KNXGroupCache.__instance = object.__new__(cls)
+        return KNXGroupCache.__instance
+
+    @staticmethod
+    def initialize(ttl=None):
+        """ defines the time to live in seconds, 0 disables expiry of entries """
+        if ttl is not None:
+            KNXGroupCache.__ttl = float(ttl)
+
+    def get(self, knxAddr: str):
+        """
+        returns the last known raw value in hex representation (e.g. '0C 1A')
+        :returns None if address was never seen or entry expired
+        """
+        try:
+            entry = KNXGroupCache.__values.get(knxAddrToInt(knxAddr))
+        except ValueError:
+            return None
+
+        if entry is None:
+            return None
+        if KNXGroupCache.__ttl > 0 and time.monotonic() - entry[1] > KNXGroupCache.__ttl:
+            return None
+        return entry[0]
+
+    def update(self, knxAddr, raw: str):
+        """ stores raw value in hex representation for given group address (x/y/z or 16bit value) """
+        if raw is None:
+            return
+        gaddr = knxAddr if isinstance(knxAddr, int) else knxAddrToInt(knxAddr)
+        KNXGroupCache.__values[gaddr] = (raw.strip(), time.monotonic())
+
+    def watch(self, knxAddr: str):
+        """ registers bus monitor listener for group address to keep the shadow value current """
+        try:
+            gaddr = knxAddrToInt(knxAddr)
+        except ValueError:
+            return
+
+        with KNXGroupCache.__lock:
+            if gaddr in KNXGroupCache.__listeners:
+                return
+            listener = _KNXGroupCacheListener(knxAddr)
+            KNXGroupCache.__listeners[gaddr] = listener
+
+        EIBClientFactory().registerListener(listener)
+
+
+class _KNXGroupCacheListener(EIBClientListener):
+    """ feeds group telegrams seen on the bus into the shadow cache """
+
+    def __init__(self, knxAddr: str):
+        super().__init__(knxAddr)
+
+    def updateOccurred(self, srcAddr, val):
+        if val is None:
+            return
+        try:
+            raw = printValue(val, len(val))
+            if raw:
+                KNXGroupCache().update(self.gaddrInt, raw)
+        except TypeError as ex:
+            log('warning',
+                'Group cache update failed for {0} - {1}'.format(self.gaddrInt, ex))
@@ -0,0 +1,237 @@
+import socket
+import struct
+import threading
+import time
+
+from core.util.BasicUtil import log
+
+# default TCP port knxd listens on for EIB protocol clients (knxd -i)
+KNXD_DEFAULT_PORT = 6720
+
+# EIB protocol message types as defined by knxd (eibtypes.h)
+EIB_OPEN_GROUPCON = 0x0026
+EIB_GROUP_PACKET = 0x0027
+
+# application layer control field for a group value write telegram
+KNX_APCI_GROUPWRITE = 0x80
+
+# reconnect backoff boundaries in seconds
+KNXD_RECONNECT_MIN = 1
+KNXD_RECONNECT_MAX = 60
+
+
+def knxAddrToInt(knxAddr: str) -> int:
+    """
+    converts a KNX group address in 3-level (x/y/z), 2-level (x/z) or free representation into its 16bit value
+    :raises ValueError in case address cannot be interpreted
+    """
+    parts = [int(p) for p in str(knxAddr).strip().replace('.', '/').split('/')]
+
+    if len(parts) == 3:
+        return ((parts[0] & 0x1F) << 11) | ((parts[1] & 0x07) << 8) | (parts[2] & 0xFF)
+    elif len(parts) == 2:
+        return ((parts[0] & 0x1F) << 11) | (parts[1] & 0x7FF)
+    elif len(parts) == 1:
+        return parts[0] & 0xFFFF
+
+    raise ValueError('invalid KNX group address "{0}"'.format(knxAddr))
+
+
+def dptToBytes(dpt: str) -> bytes:
+    """
+    converts the blank separated hex representation created by DPTXlatorBaseFacade.valueToData() into bytes
+    """
+    return bytes(int(tok, 16) for tok in dpt.split())
+
+
+class KNXDTransport:
+    """
+    abstract byte stream transport towards knxd
+    derive to provide alternative channels, e.g. unix domain sockets or a local stand-in for testing
+    """
+
+    def open(self):
+        raise NotImplementedError
+
+    def send(self, data: bytes):
+        raise NotImplementedError
+
+    def recv(self, size: int) -> bytes:
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def getName(self) -> str:
+        return self.__class__.__name__
+
+
+class KNXDSocketTransport(KNXDTransport):
+    """ TCP transport towards knxd EIB protocol server """
+
+    def __init__(self, host, port=None, timeout=5.0):
+        self.host = host
+        self.port = int(port) if port else KNXD_DEFAULT_PORT
+        self.timeout = timeout
+        self.__sock = None
+
+    def open(self):
+        self.__sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        # telegrams are small, do not wait for Nagle to fill up the segment
+        self.__sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, data: bytes):
+        if self.__sock is None:
+            raise ConnectionError('transport not open')
+        self.__sock.sendall(data)
+
+    def recv(self, size: int) -> bytes:
+        if self.__sock is None:
+            raise ConnectionError('transport not open')
+        buf = b''
+        while len(buf) < size:
+            chunk = self.__sock.recv(size - len(buf))
+            if not chunk:
+                raise ConnectionError('connection closed by knxd')
+            buf += chunk
+        return buf
+
+    def close(self):
+        if self.__sock is not None:
+            try:
+                self.__sock.close()
+            finally:
+                self.__sock = None
+
+    def getName(self) -> str:
+        return 'ip:{0}:{1}'.format(self.host, self.port)
+
+
+class KNXDConnection:
+    """
+    central singleton keeping one long-living EIB protocol connection to knxd for group writes
+    replaces spawning a 'knxtool groupwrite' process per telegram, reconnects transparently with backoff
+    """
+    __instance = None
+    __transport = None
+    __connected = False
+    __lock = threading.Lock()
+    __retryDelay = KNXD_RECONNECT_MIN
+    __nextRetry = 0
+
+    def __new__(cls, *args, **kwargs):
+        if KNXDConnection.__instance is None:
+            KNXDConnection.__instance = object.__new__(cls)
+        return KNXDConnection.__instance
+
+    @staticmethod
+    def initialize(transport: KNXDTransport):
+        """ defines the transport used for all further connections, closes any existing connection """
+        with KNXDConnection.__lock:
+            KNXDConnection.__disconnect()
+            KNXDConnection.__transport = transport
+            KNXDConnection.__retryDelay = KNXD_RECONNECT_MIN
+            KNXDConnection.__nextRetry = 0
+
+    @property
+    def isConnected(self) -> bool:
+        return KNXDConnection.__connected
+
+    def groupWrite(self, knxDest: str, dpt: str) -> bool:
+        """
+        sends a group value write telegram, equivalent to 'knxtool groupwrite <knxDest> <dpt>'
+        :param knxDest: KNX group address in x/y/z representation
+        :param dpt:     blank separated hex bytes as created by DPTXlatorBaseFacade.valueToData()
+        :returns true if telegram was handed over to knxd
+        """
+        try:
+            frame = struct.pack('>HH', EIB_GROUP_PACKET, knxAddrToInt(knxDest)) + \
+                    bytes([0x00, KNX_APCI_GROUPWRITE]) + dptToBytes(dpt)
+        except (ValueError, struct.error) as ex:
+            log('error',
+                'Could not build KNX telegram for [{0}] value={1} - {2}'.format(knxDest, dpt, ex))
+            return False
+
+        with KNXDConnection.__lock:
+            # retry once on a fresh connection, knxd might have dropped an idle connection
+            for attempt in range(2):
+                if not KNXDConnection.__connect():
+                    return False
+                try:
+                    KNXDConnection.__send(frame)
+                    return True
+                except OSError as ex:
+                    log('warning',
+                        'Connection to knxd lost ({0}) [{1}]: {2}'.format(KNXDConnection.__transport.getName(),
+                                                                          knxDest, ex))
+                    KNXDConnection.__disconnect()
+                    # enforce immediate reconnect for the retry
+                    KNXDConnection.__nextRetry = 0
+
+        return False
+
+    def close(self):
+        with KNXDConnection.__lock:
+            KNXDConnection.__disconnect()
+
+    #########################################
+    #   EIB protocol handling, lock held    #
+    #########################################
+    @staticmethod
+    def __send(frame: bytes):
+        # EIB protocol frames are prefixed by 2 byte length
+        KNXDConnection.__transport.send(struct.pack('>H', len(frame)) + frame)
+
+    @staticmethod
+    def __receive() -> bytes:
+        size = struct.unpack('>H', KNXDConnection.__transport.recv(2))[0]
+        return KNXDConnection.__transport.recv(size)
+
+    @staticmethod
+    def __connect() -> bool:
+        if KNXDConnection.__connected:
+            return True
+
+        # lazy default transport based on central KNX gateway definition
+        if KNXDConnection.__transport is None:
+            from core.DeviceBase import KNXGateway
+            if KNXGateway().hostIP is None:
+                return False
+            KNXDConnection.__transport = KNXDSocketTransport(KNXGateway().hostIP)
+
+        # respect backoff after failed attempts
+        if time.monotonic() < KNXDConnection.__nextRetry:
+            return False
+
+        try:
+            KNXDConnection.__transport.open()
+            # open write-only group socket (flag in byte 4 as EIBOpen_GroupSocket does),
+            # knxd will not forward incoming telegrams on this connection
+            KNXDConnection.__send(struct.pack('>HBBB', EIB_OPEN_GROUPCON, 0x00, 0x00, 0xFF))
+            response = KNXDConnection.__receive()
+            if len(response) < 2 or struct.unpack('>H', response[:2])[0] != EIB_OPEN_GROUPCON:
+                raise ConnectionError('knxd rejected group connection')
+
+            KNXDConnection.__connected = True
+            KNXDConnection.__retryDelay = KNXD_RECONNECT_MIN
+            log('info',
+                'Connected to knxd ({0})'.format(KNXDConnection.__transport.getName()))
+        except (OSError, struct.error) as ex:
+            log('error',
+                'Could not connect to knxd ({0}), retry in {1}s: {2}'.format(KNXDConnection.__transport.getName(),
+                                                                            KNXDConnection.__retryDelay,
+                                                                            ex))
+            KNXDConnection.__disconnect()
+            KNXDConnection.__nextRetry = time.monotonic() + KNXDConnection.__retryDelay
+            KNXDConnection.__retryDelay = min(KNXDConnection.__retryDelay * 2, KNXD_RECONNECT_MAX)
+
+        return KNXDConnection.__connected
+
+    @staticmethod
+    def __disconnect():
+        KNXDConnection.__connected = False
+        if KNXDConnection.__transport is not None:
+            try:
+                KNXDConnection.__transport.close()
+            except OSError:
+                pass
@@ -0,0 +1,128 @@
+import threading
+
+from EIBClient import EIBClientFactory, EIBClientListener
+from common import printValue
+from core.util.BasicUtil import log
+from core.util.KNXDCache import KNXGroupCache
+from core.util.KNXDConnection import knxAddrToInt
+from core.util.KNXDUtil import DPTXlatorFactoryFacade
+from pknyx.core.dptXlator.dptXlatorBase import DPTXlatorValueError
+
+
+class KNXDependencyGraph:
+    """
+    central singleton resolving KNX addresses referenced by functions (e.g. sub(1/2/3)) from bus telegrams
+    dependents of a referenced address are notified whenever its value changes
+    """
+    __instance = None
+    # group address -> latest raw value in hex representation
+    __values = {}
+    # (group address, knx format) -> decoded value
+    __decoded = {}
+    # group address -> dependents providing referenceChanged(knxAddr)
+    __dependents = {}
+    __listeners = {}
+    __lock = threading.Lock()
+    __stats = {'updates': 0, 'notifications': 0, 'misses': 0}
+
+    def __new__(cls, *args, **kwargs):
+        if KNXDependencyGraph.__instance is None:
+            KNXDependencyGraph.__instance = object.__new__(cls)
+        return KNXDependencyGraph.__instance
+
+    def subscribe(self, knxAddr: str, dependent=None):
+        """
+        registers bus monitor listener for referenced address
+        :param dependent:   object with referenceChanged(knxAddr) called from the bus monitor thread on changes
+        """
+        gaddr = knxAddrToInt(knxAddr)
+
+        with KNXDependencyGraph.__lock:
+            if dependent is not None:
+                dependents = KNXDependencyGraph.__dependents.setdefault(gaddr, [])
+                if dependent not in dependents:
+                    dependents.append(dependent)
+            if gaddr in KNXDependencyGraph.__listeners:
+                return
+            listener = _KNXDependencyListener(knxAddr)
+            KNXDependencyGraph.__listeners[gaddr] = listener
+
+        EIBClientFactory().registerListener(listener)
+
+    def getValue(self, knxAddr: str, knxFormat: str):
+        """
+        returns latest value of referenced address in python representation of given format
+        :returns None if address was not seen on the bus so far
+        """
+        try:
+            gaddr = knxAddrToInt(knxAddr)
+        except ValueError:
+            return None
+
+        key = (gaddr, knxFormat)
+        val = KNXDependencyGraph.__decoded.get(key)
+        if val is not None:
+            return val
+
+        raw = KNXDependencyGraph.__values.get(gaddr)
+        if raw is None:
+            # value may have been read or written by the bridge before the first telegram was seen
+            raw = KNXGroupCache().get(knxAddr)
+            if raw is None:
+                KNXDependencyGraph.__stats['misses'] += 1
+                return None
+            KNXDependencyGraph.__values.setdefault(gaddr, raw)
+
+        dc = DPTXlatorFactoryFacade().create(knxFormat)
+        if dc is None:
+            return None
+        try:
+            val = dc.dataToValue(int("0x" + raw.replace(" ", ""), 16))
+        except (DPTXlatorValueError, TypeError, ValueError) as ex:
+            log('error',
+                'Referenced value could not be decoded [{0}] value={1} - Check type definition for DPT type "{2}" - {3}'.format(
+                    knxAddr, raw, knxFormat, ex))
+            return None
+
+        KNXDependencyGraph.__decoded[key] = val
+        return val
+
+    def update(self, gaddr: int, raw: str):
+        """ stores new raw value of referenced address and notifies dependents in case of a change """
+        raw = raw.strip()
+        with KNXDependencyGraph.__lock:
+            if KNXDependencyGraph.__values.get(gaddr) == raw:
+                return
+            KNXDependencyGraph.__values[gaddr] = raw
+            for key in [key for key in KNXDependencyGraph.__decoded if key[0] == gaddr]:
+                del KNXDependencyGraph.__decoded[key]
+            dependents = list(KNXDependencyGraph.__dependents.get(gaddr, ()))
+            KNXDependencyGraph.__stats['updates'] += 1
+
+        for dependent in dependents:
+            KNXDependencyGraph.__stats['notifications'] += 1
+            dependent.referenceChanged(gaddr)
+
+    def getStatistics(self) -> dict:
+        """ returns number of referenced addresses, value changes, notified dependents and unresolved lookups """
+        stats = dict(KNXDependencyGraph.__stats)
+        stats['references'] = len(KNXDependencyGraph.__listeners)
+        return stats
+
+
+class _KNXDependencyListener(EIBClientListener):
+    """ feeds group telegrams of referenced addresses into the dependency graph """
+
+    def __init__(self, knxAddr: str):
+        super().__init__(knxAddr)
+
+    def updateOccurred(self, srcAddr, val):
+        if val is None:
+            return
+        try:
+            raw = printValue(val, len(val))
+            if raw:
+                KNXDependencyGraph().update(self.gaddrInt, raw)
+        except TypeError as ex:
+            log('warning',
+                'Referenced value update failed for {0} - {1}'.format(self.gaddrInt, ex))
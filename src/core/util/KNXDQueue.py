@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import OrderedDict
+
+from core.util.BasicUtil import log
+from core.util.KNXDCache import KNXGroupCache
+from core.util.KNXDConnection import KNXDConnection
+
+# default telegram budget, a TP1 line realistically carries ~20-40 telegrams per second
+KNXQUEUE_DEFAULT_RATE = 20
+# default number of telegrams that may be sent back to back after an idle period
+KNXQUEUE_DEFAULT_BURST = 5
+# default number of distinct group addresses waiting to be sent
+KNXQUEUE_DEFAULT_SIZE = 500
+
+
+class KNXWriteQueue:
+    """
+    central singleton serializing all outbound group writes
+    pending writes to the same group address are coalesced (latest value wins),
+    telegrams leave the queue within the configured telegrams per second budget
+    """
+    __instance = None
+    __pending = OrderedDict()
+    __cond = threading.Condition()
+    __worker = None
+    __running = False
+    __rate = KNXQUEUE_DEFAULT_RATE
+    __burst = KNXQUEUE_DEFAULT_BURST
+    __maxSize = KNXQUEUE_DEFAULT_SIZE
+    __tokens = KNXQUEUE_DEFAULT_BURST
+    __lastRefill = time.monotonic()
+    __stats = {'sent': 0, 'coalesced': 0, 'dropped': 0, 'failed': 0}
+
+    def __new__(cls, *args, **kwargs):
+        if KNXWriteQueue.__instance is None:
+            KNXWriteQueue.__instance = object.__new__(cls)
+        return KNXWriteQueue.__instance
+
+    @staticmethod
+    def initialize(rate=None, burst=None, maxSize=None):
+        """ defines telegram budget (telegrams/sec), burst size and max number of pending addresses """
+        with KNXWriteQueue.__cond:
+            if rate:
+                KNXWriteQueue.__rate = float(rate)
+            if burst:
+                KNXWriteQueue.__burst = max(1, int(burst))
+            if maxSize:
+                KNXWriteQueue.__maxSize = int(maxSize)
+            KNXWriteQueue.__tokens = KNXWriteQueue.__burst
+
+    def enqueue(self, knxDest: str, dpt: str) -> bool:
+        """
+        queues group write, replaces value of a pending write for the same address
+        :returns false if the telegram was dropped due to a full queue
+        """
+        with KNXWriteQueue.__cond:
+            if knxDest in KNXWriteQueue.__pending:
+                KNXWriteQueue.__pending[knxDest] = dpt
+                KNXWriteQueue.__stats['coalesced'] += 1
+                return True
+
+            if len(KNXWriteQueue.__pending) >= KNXWriteQueue.__maxSize:
+                KNXWriteQueue.__stats['dropped'] += 1
+                log('warning',
+                    'KNX write queue full ({0}), dropped telegram [{1}] value={2}'.format(KNXWriteQueue.__maxSize,
+                                                                                         knxDest, dpt))
+                return False
+
+            KNXWriteQueue.__pending[knxDest] = dpt
+            KNXWriteQueue.__start()
+            KNXWriteQueue.__cond.notify()
+        return True
+
+    @property
+    def depth(self) -> int:
+        return len(KNXWriteQueue.__pending)
+
+    def getStatistics(self) -> dict:
+        """ returns queue depth and counters for sent, coalesced, dropped and failed telegrams """
+        with KNXWriteQueue.__cond:
+            stats = dict(KNXWriteQueue.__stats)
+            stats['depth'] = len(KNXWriteQueue.__pending)
+        return stats
+
+    def stop(self, timeout=5.0):
+        """ stops worker after pending telegrams were sent or timeout is reached """
+        deadline = time.monotonic() + timeout
+        with KNXWriteQueue.__cond:
+            while KNXWriteQueue.__pending and time.monotonic() < deadline:
+                KNXWriteQueue.__cond.wait(0.1)
+            KNXWriteQueue.__running = False
+            KNXWriteQueue.__cond.notify_all()
+        if KNXWriteQueue.__worker is not None:
+            KNXWriteQueue.__worker.join(timeout)
+            KNXWriteQueue.__worker = None
+
+    #########################################
+    #   worker thread                       #
+    #########################################
+    @staticmethod
+    def __start():
+        # lock held by caller
+        if KNXWriteQueue.__running:
+            return
+        KNXWriteQueue.__running = True
+        KNXWriteQueue.__worker = threading.Thread(target=KNXWriteQueue.__run,
+                                                  name='KNXWriteQueue', daemon=True)
+        KNXWriteQueue.__worker.start()
+
+    @staticmethod
+    def __acquireToken() -> float:
+        """ lock held by caller, returns 0 if a telegram may be sent or seconds to wait for next token """
+        now = time.monotonic()
+        KNXWriteQueue.__tokens = min(KNXWriteQueue.__burst,
+                                     KNXWriteQueue.__tokens + (now - KNXWriteQueue.__lastRefill) * KNXWriteQueue.__rate)
+        KNXWriteQueue.__lastRefill = now
+        if KNXWriteQueue.__tokens >= 1:
+            KNXWriteQueue.__tokens -= 1
+            return 0
+        return (1 - KNXWriteQueue.__tokens) / KNXWriteQueue.__rate
+
+    @staticmethod
+    def __run():
+        while True:
+            with KNXWriteQueue.__cond:
+                while KNXWriteQueue.__running and not KNXWriteQueue.__pending:
+                    KNXWriteQueue.__cond.wait()
+                if not KNXWriteQueue.__running:
+                    return
+
+                wait = KNXWriteQueue.__acquireToken()
+                if wait > 0:
+                    # keep queue open for coalescing while waiting for the budget
+                    KNXWriteQueue.__cond.wait(wait)
+                    continue
+
+                knxDest, dpt = KNXWriteQueue.__pending.popitem(last=False)
+
+            # send outside of lock, producers must not wait for the bus
+            sent = KNXDConnection().groupWrite(knxDest, dpt)
+            if sent:
+                # shadow the value only once it is on the bus for further comparisons
+                KNXGroupCache().update(knxDest, dpt)
+            else:
+                log('error',
+                    'Telegram could not be sent to KNX bus [{0}] value={1}'.format(knxDest, dpt))
+
+            with KNXWriteQueue.__cond:
+                KNXWriteQueue.__stats['sent' if sent else 'failed'] += 1
+                # wake up stop() waiting for queue to drain
+                KNXWriteQueue.__cond.notify_all()
@@ -11,13 +11,19 @@ class DPTXlatorFactoryObjectFacade:
 
     def __init__(self, dptfImpl):
         self.__dptfImpl = dptfImpl
+        # translators are stateless, share one instance per DPT
+        self.__xlators = {}
 
     def create(self, dptId):
         """ wrap DPT object for customization """
-        ret = None
+        ret = self.__xlators.get(dptId)
+        if ret is not None:
+            return ret
+
         try:
             dptHandler = self.__dptfImpl.create(dptId)
             ret = DPTXlatorBaseFacade(dptHandler)
+            self.__xlators[dptId] = ret
         except DPTXlatorValueError as e:
             log('error',
                 'KNXDUtil - DPTXlatorError: {0}'.format(e))
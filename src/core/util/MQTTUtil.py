@@ -0,0 +1,122 @@
+import re
+
+# one path step - .key, ['key'] / ["key"] or [index]
+MQTTJSONPATHSTEP = re.compile(r"""\.([^.\[\]]+)|\[\s*(?:'([^']*)'|"([^"]*)"|(-?\d+))\s*\]""")
+
+
+class MQTTTopicTrie:
+    """
+    dispatch table mapping MQTT topic filters to handlers, one trie level per topic level
+    supports the single level '+' and multi level '#' wildcards
+    """
+
+    def __init__(self):
+        self.__root = _MQTTTopicNode()
+        self.__filters = set()
+
+    @property
+    def filters(self) -> set:
+        """ all registered topic filters """
+        return set(self.__filters)
+
+    def add(self, topicFilter: str, handler) -> bool:
+        """
+        registers handler for topic filter
+        :returns true if the topic filter was not registered before
+        """
+        node = self.__root
+        for level in topicFilter.split('/'):
+            node = node.children.setdefault(level, _MQTTTopicNode())
+        node.handlers.append(handler)
+
+        isNew = topicFilter not in self.__filters
+        self.__filters.add(topicFilter)
+        return isNew
+
+    def match(self, topic: str) -> list:
+        """ returns handlers of all topic filters matching the topic """
+        handlers = []
+        levels = topic.split('/')
+        # wildcards on the first level do not match system topics like $SYS
+        self.__match(self.__root, levels, 0, handlers, topic.startswith('$'))
+        return handlers
+
+    def __match(self, node, levels, index, handlers, system):
+        wildcard = not (system and index == 0)
+
+        # '#' also matches the parent level, e.g. 'a/#' matches 'a'
+        multi = node.children.get('#')
+        if multi is not None and wildcard:
+            handlers.extend(multi.handlers)
+
+        if index == len(levels):
+            handlers.extend(node.handlers)
+            return
+
+        child = node.children.get(levels[index])
+        if child is not None:
+            self.__match(child, levels, index + 1, handlers, system)
+        single = node.children.get('+')
+        if single is not None and wildcard:
+            self.__match(single, levels, index + 1, handlers, system)
+
+
+class _MQTTTopicNode:
+    __slots__ = ('children', 'handlers')
+
+    def __init__(self):
+        self.children = {}
+        self.handlers = []
+
+
+class mqtt_utils:
+    """ Utility for payload interpretation for MQTT protocol """
+
+    MQTTFORMAT_JSON = "json"
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def compileJSONPath(path: str) -> tuple:
+        """
+        compiles path expression like '$.ENERGY.Power' or '$.data[0]['temp']' into a tuple of keys and indices
+        :raises ValueError in case of an invalid path expression
+        """
+        if path is None:
+            return ()
+        path = path.strip()
+        if not path.startswith('$'):
+            raise ValueError('JSON path "{0}" must start with "$"'.format(path))
+
+        steps = []
+        pos = 1
+        while pos < len(path):
+            step = MQTTJSONPATHSTEP.match(path, pos)
+            if step is None:
+                raise ValueError('invalid JSON path "{0}" at position {1}'.format(path, pos))
+            key, single, double, index = step.groups()
+            if index is not None:
+                steps.append(int(index))
+            else:
+                steps.append(next(k for k in (key, single, double) if k is not None))
+            pos = step.end()
+        return tuple(steps)
+
+    @staticmethod
+    def extractJSONPath(doc, steps: tuple):
+        """
+        resolves compiled path within decoded JSON document
+        :raises LookupError if path does not exist in document
+        """
+        val = doc
+        for step in steps:
+            if isinstance(step, int):
+                if not isinstance(val, list):
+                    raise LookupError(step)
+                val = val[step]
+            else:
+                if not isinstance(val, dict):
+                    raise LookupError(step)
+                val = val[step]
+        return val
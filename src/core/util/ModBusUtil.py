@@ -1,9 +1,128 @@
 
 # https://forum.fhem.de/index.php/topic,75638.msg987876.html?PHPSESSID=b17q82mhkt6bjj8s550cmgrdjr#msg987876
+import struct
+import sys
+from array import array
+
 from pymodbus.constants import Endian
 from pymodbus.payload import BinaryPayloadDecoder
 
 
+# max number of registers per read holding registers request (limited by ModBus PDU size)
+MODBUS_MAX_REGISTERS = 125
+# default ModBus unit id (SunSpec inverters)
+MODBUS_DEFAULT_UNIT = 71
+
+# supported ModBus formats - number of registers and struct format character
+MODBUSFORMATDEF = {
+    "int16": (1, 'h'),
+    "uint16": (1, 'H'),
+    "int32": (2, 'i'),
+    "uint32": (2, 'I'),
+    "int64": (4, 'q'),
+    "uint64": (4, 'Q'),
+    "float32": (2, 'f'),
+    "float64": (4, 'd'),
+    # legacy format, float32 rounded to 2 decimals
+    "float": (2, 'f'),
+    # number of registers defined by modbusLength, 2 characters per register
+    "string": (None, 's')
+}
+
+# byte order within a register/word order of multi register values
+MODBUSORDERDEF = ("big", "little")
+
+
+class ModBusField:
+    """ compiled definition of one value within the register map of an appliance """
+    __slots__ = ('addr', 'count', 'format', 'scale', 'precision', 'struct')
+
+    def __init__(self, addr, mbFormat, scale=None, length=None):
+        if mbFormat not in MODBUSFORMATDEF:
+            raise ValueError('ModBus format "{0}" not supported'.format(mbFormat))
+
+        count, fmt = MODBUSFORMATDEF[mbFormat]
+        if mbFormat == 'string':
+            if not length:
+                raise ValueError('ModBus format "string" requires modbusLength')
+            count = int(length)
+            fmt = '{0}s'.format(2 * count)
+
+        self.addr = int(addr)
+        self.count = count
+        self.format = mbFormat
+        self.scale = float(scale) if scale is not None else None
+        self.precision = 2 if mbFormat == 'float' else None
+        # registers are normalized to big endian byte/word order before unpacking
+        self.struct = struct.Struct('>' + fmt)
+
+    @property
+    def span(self):
+        """ tuple of start address and number of registers """
+        return self.addr, self.count
+
+
+class ModBusRegisterDecoder:
+    """
+    decodes values from raw register blocks according to the byte and word order of an appliance
+    each block is converted into a byte buffer once, all fields within the block are unpacked from it
+    """
+
+    def __init__(self, byteorder=None, wordorder=None):
+        self.byteorder = byteorder if byteorder else "big"
+        self.wordorder = wordorder if wordorder else "little"
+        if self.byteorder not in MODBUSORDERDEF or self.wordorder not in MODBUSORDERDEF:
+            raise ValueError('ModBus byte/word order must be one of {0}'.format(MODBUSORDERDEF))
+
+    def decode(self, fields, blocks) -> dict:
+        """
+        decodes all fields located within the given register blocks in one pass per block
+        :param fields:  list of ModBusField
+        :param blocks:  list of tuples (start address, list of registers)
+        :returns dictionary of field and decoded value, fields outside the blocks are omitted
+        """
+        values = {}
+        pending = sorted(fields, key=lambda f: f.addr)
+
+        for start, registers in blocks:
+            end = start + len(registers)
+            buf = None
+            for field in pending:
+                if field.addr < start or field.addr + field.count > end:
+                    continue
+                if buf is None:
+                    buf = self.__toBytes(registers)
+                values[field] = self.__unpack(field, buf, 2 * (field.addr - start))
+
+        return values
+
+    def decodeRegisters(self, field: ModBusField, registers):
+        """ decodes a single field from its own registers """
+        return self.__unpack(field, self.__toBytes(registers), 0)
+
+    def __toBytes(self, registers) -> bytes:
+        regs = array('H', registers)
+        # array uses native byte order, bring each register to the configured byte order in memory
+        if (sys.byteorder == 'little') == (self.byteorder == 'big'):
+            regs.byteswap()
+        return regs.tobytes()
+
+    def __unpack(self, field: ModBusField, buf: bytes, offset: int):
+        raw = buf[offset:offset + 2 * field.count]
+        # bring multi register numbers to big endian word order
+        if field.count > 1 and self.wordorder == 'little' and field.format != 'string':
+            raw = b''.join(raw[i:i + 2] for i in range(len(raw) - 2, -1, -2))
+        val = field.struct.unpack(raw)[0]
+
+        if field.format == 'string':
+            return val.decode('ascii', errors='ignore').strip('\x00 ')
+        if field.scale is not None:
+            val = val * field.scale
+        if field.precision is not None:
+            val = round(val, field.precision)
+        return val
+
+
 class modbus_utils:
     """ Utility for number conversion from ModBus registers """
 
@@ -11,49 +130,70 @@ class modbus_utils:
         pass
 
     @staticmethod
-    def ReadStr8(client, myadr_dec):
+    def planBlocks(spans, maxGap=0, maxCount=MODBUS_MAX_REGISTERS):
+        """
+        merges register spans into contiguous blocks for combined read requests
+        :param spans:       list of tuples (start address, number of registers)
+        :param maxGap:      max number of unused registers between two spans that are still read in one block
+        :param maxCount:    max number of registers per block
+        :returns list of tuples (start address, number of registers)
+        """
+        blocks = []
+        for start, count in sorted(set(spans)):
+            end = start + count
+            if blocks:
+                bStart, bEnd = blocks[-1]
+                # merge overlapping/close spans as long as the block fits into one request
+                if start - bEnd <= maxGap and max(end, bEnd) - bStart <= maxCount:
+                    blocks[-1] = (bStart, max(end, bEnd))
+                    continue
+            blocks.append((start, end))
+        return [(start, end - start) for start, end in blocks]
+
+    @staticmethod
+    def ReadStr8(client, myadr_dec, unit=MODBUS_DEFAULT_UNIT):
         """ Routine to read a string from one address with 8 registers  """
-        r1 = client.read_holding_registers(myadr_dec, 8, unit=71)
+        r1 = client.read_holding_registers(myadr_dec, 8, unit=unit)
         STRG8Register = BinaryPayloadDecoder.fromRegisters(r1.registers, byteorder=Endian.Big)
         result_STRG8Register = STRG8Register.decode_string(8)
         return result_STRG8Register
 
     @staticmethod
-    def ReadFloat(client, myadr_dec):
+    def ReadFloat(client, myadr_dec, unit=MODBUS_DEFAULT_UNIT):
         """ Routine to read a Float from one address with 2 registers """
-        r1 = client.read_holding_registers(myadr_dec, 2, unit=71)
+        r1 = client.read_holding_registers(myadr_dec, 2, unit=unit)
         FloatRegister = BinaryPayloadDecoder.fromRegisters(r1.registers, byteorder=Endian.Big, wordorder=Endian.Little)
         result_FloatRegister = round(FloatRegister.decode_32bit_float(), 2)
         return result_FloatRegister
 
     @staticmethod
-    def ReadU16_1(client, myadr_dec):
+    def ReadU16_1(client, myadr_dec, unit=MODBUS_DEFAULT_UNIT):
         """ Routine to read a U16 from one address with 1 register """
-        r1 = client.read_holding_registers(myadr_dec, 1, unit=71)
+        r1 = client.read_holding_registers(myadr_dec, 1, unit=unit)
         U16register = BinaryPayloadDecoder.fromRegisters(r1.registers, byteorder=Endian.Big, wordorder=Endian.Little)
         result_U16register = U16register.decode_16bit_uint()
         return result_U16register
 
     @staticmethod
-    def ReadU16_2(client, myadr_dec):
+    def ReadU16_2(client, myadr_dec, unit=MODBUS_DEFAULT_UNIT):
         """ Routine to read a U16 from one address with 2 registers  """
-        r1 = client.read_holding_registers(myadr_dec, 2, unit=71)
+        r1 = client.read_holding_registers(myadr_dec, 2, unit=unit)
         U16register = BinaryPayloadDecoder.fromRegisters(r1.registers, byteorder=Endian.Big, wordorder=Endian.Little)
         result_U16register = U16register.decode_16bit_uint()
         return result_U16register
 
     @staticmethod
-    def ReadU32(client, myadr_dec):
+    def ReadU32(client, myadr_dec, unit=MODBUS_DEFAULT_UNIT):
         """ Routine to read a U32 from one address with 2 registers  """
-        r1 = client.read_holding_registers(myadr_dec, 2, unit=71)
+        r1 = client.read_holding_registers(myadr_dec, 2, unit=unit)
         U32register = BinaryPayloadDecoder.fromRegisters(r1.registers, byteorder=Endian.Big, wordorder=Endian.Little)
         result_U32register = U32register.decode_32bit_uint()
         return result_U32register
 
     @staticmethod
-    def ReadS16(client, myadr_dec):
-        """ Routine to read a U32 from one address with 2 registers  """
-        r1 = client.read_holding_registers(myadr_dec, 1, unit=71)
+    def ReadS16(client, myadr_dec, unit=MODBUS_DEFAULT_UNIT):
+        """ Routine to read a S16 from one address with 1 register """
+        r1 = client.read_holding_registers(myadr_dec, 1, unit=unit)
         S16register = BinaryPayloadDecoder.fromRegisters(r1.registers, byteorder=Endian.Big, wordorder=Endian.Little)
-        result_S16register = S16register.decode_16bit_uint()
+        result_S16register = S16register.decode_16bit_int()
         return result_S16register
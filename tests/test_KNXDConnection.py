@@ -0,0 +1,63 @@
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from core.util.KNXDConnection import KNXDConnection, KNXDTransport, EIB_OPEN_GROUPCON
+
+
+class FakeKNXDTransport(KNXDTransport):
+    """ stand-in for knxd recording all frames, acknowledges the group connection request """
+
+    def __init__(self):
+        self.sent = []
+        self.opened = 0
+        self.__response = b''
+
+    def open(self):
+        self.opened += 1
+
+    def send(self, data: bytes):
+        self.sent.append(data)
+        if data[2:4] == struct.pack('>H', EIB_OPEN_GROUPCON):
+            self.__response = struct.pack('>HH', 2, EIB_OPEN_GROUPCON)
+
+    def recv(self, size: int) -> bytes:
+        data, self.__response = self.__response[:size], self.__response[size:]
+        return data
+
+    def close(self):
+        pass
+
+
+class KNXDConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = FakeKNXDTransport()
+        KNXDConnection.initialize(self.transport)
+
+    def tearDown(self):
+        KNXDConnection().close()
+
+    def test_open_write_only_group_socket(self):
+        self.assertTrue(KNXDConnection().groupWrite('1/2/3', '01'))
+        # length, EIB_OPEN_GROUPCON, 0x00, 0x00, write-only flag 0xFF
+        self.assertEqual(self.transport.sent[0], bytes([0x00, 0x05, 0x00, 0x26, 0x00, 0x00, 0xFF]))
+
+    def test_group_write_frame(self):
+        self.assertTrue(KNXDConnection().groupWrite('1/2/3', '0C 1A'))
+        # length, EIB_GROUP_PACKET, group address 1/2/3, TPCI, APCI group write, data
+        self.assertEqual(self.transport.sent[1],
+                         bytes([0x00, 0x08, 0x00, 0x27, 0x0A, 0x03, 0x00, 0x80, 0x0C, 0x1A]))
+
+    def test_connection_reused(self):
+        KNXDConnection().groupWrite('1/2/3', '01')
+        KNXDConnection().groupWrite('1/2/4', '00')
+        self.assertEqual(self.transport.opened, 1)
+        self.assertEqual(len(self.transport.sent), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()